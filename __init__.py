@@ -2,29 +2,62 @@
 
 import pandas as pd
 import numpy as np
-from BBQuant.dataframe import QuantDataFrame
-from BBQuant.backtest import QuantBacktest
+from BBQuant.dataframe import QuantDataFrame, QuantUniverse, universe
+from BBQuant.backtest import QuantBacktest, BENCHMARK
+from BBQuant.live import QuantLive
+from BBQuant.report import QuantReport, batch_stats
+from BBQuant.lazy import LazyQuantDataFrame, leaf
+from BBQuant.panel import QuantPanel
+from BBQuant.intraday import QuantBars
+from BBQuant.profiler import QuantProfiler, profile
+from BBQuant import cache as _cache
+from BBQuant import chunked as _chunked
 
 
-def get(data: pd.DataFrame, column: str):
+def get(data: pd.DataFrame, column: str, dtype: str = 'float64'):
     """
     將需要的欄位轉為樞紐表 (Index: 時間, Columns: 標的)
+    data 為 QuantPanel 時直接取出該欄位；為 Feather / Arrow 檔案路徑時分批串流彙總
+    dtype: 數值型別，'float32' 可使價格資料的記憶體減半
     """
+    if isinstance(data, QuantPanel):
+        return data.get(column)
+    if isinstance(data, str):
+        return QuantPanel(data, [column], dtype=dtype).get(column)
+
     data.datetime = pd.to_datetime(data.datetime)
     data = data.rename(columns={'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close', 'volume': 'Volume'})
+    func = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'}
  
-    ### 日資料
-    if data.datetime[0].hour == 0:
-        df = data.pivot(index='datetime', columns='asset', values=column)
-        df = df.replace('', np.nan).ffill().astype(float)
-        return QuantDataFrame(df)
+    ### 日資料 (重複的日期、標的與日內資料相同地彙總)
+    if data.datetime.iloc[0].hour == 0:
+        try:
+            df = data.pivot(index='datetime', columns='asset', values=column)
+        except ValueError:
+            df = data.pivot_table(index='datetime', columns='asset', values=column, aggfunc=func.get(column, 'last'))
+        df = df.replace('', np.nan).ffill().astype(dtype)
+        return QuantDataFrame(universe.assign(df))
     
-    ### 日內資料
+    ### 日內資料: 依時間先後 (同時間者依資料順序) 彙總，與 load() 相同
     else:   
-        func = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'}
+        if not data.datetime.is_monotonic_increasing:
+            data = data.iloc[np.argsort(data.datetime.values, kind='stable')]
         df = data.pivot_table(index=data.datetime.dt.date, columns='asset', values=column, aggfunc=func[column])
-        df = df.replace('', np.nan).ffill().astype(float) 
-        return QuantDataFrame(df)
+        df = df.replace('', np.nan).ffill().astype(dtype)
+        return QuantDataFrame(universe.assign(df))
+
+def load(data: pd.DataFrame, fields: list = None, batch_size: int = 65536, dtype: str = 'float64'):
+    """
+    一次讀入長格式資料 (或分批串流 Feather / Arrow 檔案)，產生所有欄位的 QuantPanel
+    """
+    return QuantPanel(data, fields, batch_size, dtype)
+
+def bars(data: pd.DataFrame, fields: list = None, batch_size: int = 1 << 20, dtype: str = 'float64'):
+    """
+    讀入日內資料 (或分批讀取 Feather / Arrow 檔案)，產生 intraday 引擎使用的 (欄位, 日期, K 棒, 標的) QuantBars
+    fields: 需要的欄位，預設 Open、High、Low
+    """
+    return QuantBars(data, fields, batch_size, dtype)
 
 def transform(data: pd.DataFrame):
     """
@@ -32,11 +65,34 @@ def transform(data: pd.DataFrame):
     """
     return QuantDataFrame(data)
 
-def setting(trade_price: QuantDataFrame, freq: str = 'D', nstocks: int = None, rank: QuantDataFrame = None, take_profit: float = np.inf, stop_loss: float = np.inf, fee: float = 0.001425, tax: float = 0.003, rf: float = 0.015):
+def lazy(data):
+    """
+    將 pd.DataFrame / QuantDataFrame 轉成延遲運算的 LazyQuantDataFrame
+    """
+    return leaf(data)
+
+def chunked(*frames, columns: int = 256, path: str = None, n_jobs: int = 1):
+    """
+    以欄位分塊、記憶體映射檔計算 LazyQuantDataFrame，結果保存於記憶體映射檔 (之後直接傳入 strategy())
+    columns: 每個分塊的標的數
+    path: 記憶體映射檔的目錄 (檔名不重複，結果檔由呼叫者管理)，預設為暫存目錄 (所有結果都被回收後自動刪除)
+    n_jobs: 平行計算分塊的進程數 (-1 為使用全部核心)
+    """
+    return _chunked.evaluate(*frames, columns=columns, path=path, n_jobs=n_jobs)
+
+def use_cache(path: str = None, max_bytes: int = 2**30):
+    """
+    啟用指標快取 (QuantDataFrame 的 shift、average、sustain 等方法)，path 為 None 時停用
+    path: 快取目錄
+    max_bytes: 容量上限，超過時淘汰最久未使用的結果
+    """
+    return _cache.use(path, max_bytes)
+
+def setting(trade_price: QuantDataFrame, freq: str = 'D', nstocks: int = None, rank: QuantDataFrame = None, take_profit: float = np.inf, stop_loss: float = np.inf, fee: float = 0.001425, tax: float = 0.003, rf: float = 0.015, engine: str = 'numpy', benchmark=BENCHMARK, bars: QuantBars = None, entry: str = 'open'):
     """
     設定回測變數
     trade_price: 進出場價格
-    freq: 調倉頻率
+    freq: 調倉頻率 (pandas 頻率字串，或自訂調倉日期，ex. 月營收公布日)
     nstocks: 持有檔數上限
     rank: 優先篩選條件
     take_profit: 停利條件
@@ -44,5 +100,9 @@ def setting(trade_price: QuantDataFrame, freq: str = 'D', nstocks: int = None, r
     fee: 手續費
     tax: 交易稅
     rf: 無風險利率
+    engine: 部位計算引擎 ('numpy'、'pandas' 或 'intraday': 以日內 K 棒的最高 / 最低價觸發停利停損，並以觸發 K 棒成交，trade_price 為開盤價；以收盤價進場時設定 entry='close')
+    benchmark: 基準指數，檔案路徑 (Feather)、價格序列 (pd.Series / 含 Close 的 pd.DataFrame)、回傳前述資料的函式，None 為不計算基準報酬
+    bars: intraday 引擎使用的日內 K 棒 (bbq.bars())
+    entry: 進場時點，'open' (開盤，進場日的 K 棒即參與 intraday 停利停損判斷) 或 'close' (收盤，自隔日開始判斷)
     """
-    return QuantBacktest(trade_price, freq, nstocks, rank, take_profit, stop_loss, fee, tax, rf)
\ No newline at end of file
+    return QuantBacktest(trade_price, freq, nstocks, rank, take_profit, stop_loss, fee, tax, rf, engine, benchmark, bars, entry)
\ No newline at end of file
@@ -2,18 +2,140 @@
 
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import platform
-from BBQuant.dataframe import QuantDataFrame
-from BBQuant.report import QuantReport
+import os
+import itertools
+from BBQuant.dataframe import QuantDataFrame, universe, _nlargest
+from BBQuant.report import QuantReport, batch_stats
+from BBQuant.lazy import evaluate
+from BBQuant.live import QuantLive
+from BBQuant.intraday import QuantBars, _override, _filled
+from BBQuant import parallel
+from BBQuant.plotting import pyplot
+from BBQuant.profiler import span, traced
 
 
-if platform.system() == "Windows":
-    plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei']
-    plt.rcParams['axes.unicode_minus'] = False
-elif platform.system() == "Darwin":
-    plt.rcParams['font.sans-serif'] = ['SimHei']
-    plt.rcParams['axes.unicode_minus'] = False
+### 預設基準指數: 不計算基準報酬 (需要時於 setting() 傳入檔案路徑、價格序列或函式)
+BENCHMARK = None
+
+
+class _NoSignal(Exception):
+    """
+    進出場條件沒有產生任何持有部位 (strategy() 回傳全為 0 的部位)
+    """
+
+
+def _top(values: np.ndarray, mask: np.ndarray, n: int):
+    """
+    取 mask 標的中數值最大的前Ｎ筆 (忽略 NaN，同值時依欄位順序，與 nlargest 相同)
+    """
+    return _nlargest(np.where(mask, values, np.nan)[None], n)[0]
+
+
+def _order(ranking: np.ndarray):
+    """
+    排名順序索引: 每日標的依排名由大到小排列的欄位位置 (同值時依欄位順序，與 nlargest 相同)
+    建立一次後可供不同持有檔數上限共用
+    """
+    return np.argsort(-ranking, axis=1, kind='stable').astype(np.int32)
+
+
+def _pick(order: np.ndarray, mask: np.ndarray, n: int):
+    """
+    依排名順序取 mask 標的中的前Ｎ筆 (遮罩後的前綴掃描)
+    """
+    select = np.zeros(len(order), dtype=bool)
+    if n > 0:
+        select[order[mask[order]][:n]] = True
+    return select
+
+
+def _hold(position: np.ndarray, entry: np.ndarray, ranking: np.ndarray, price: np.ndarray, first: np.ndarray, nstocks: int, take_profit, stop_loss, trigger=None, order: np.ndarray = None):
+    """
+    以 NumPy 陣列執行持有檔數上限、停利、停損的逐日狀態更新
+    position: 原始持有訊號 (bool)
+    entry: 原始進場訊號 (bool)
+    ranking: 正規化後的排名 (前一日排名決定當日進場順序)
+    price: 進出場價格
+    first: 首日的排名
+    take_profit, stop_loss: 停利/停損條件，可傳入多組，結果依序堆疊為第一維 (組數, 日期, 標的)
+    trigger: 停利停損判斷 (i, 持有, 當日新進場, 進場價格, 停利, 停損) -> 隔日出場，預設以當日價格與進場價格的比值判斷 (intraday 引擎為 QuantBars.trigger)
+    order: ranking 的順序索引 (_order)，批次評估多組條件時預先建立以共用，None 時只在持有上限生效的日期以 _top 取前Ｎ筆
+    """
+    take_profit = np.atleast_1d(np.asarray(take_profit, dtype=float))[:, None]
+    stop_loss = np.atleast_1d(np.asarray(stop_loss, dtype=float))[:, None]
+    hold = np.repeat(position[None], len(take_profit), axis=0)
+    hold[:, 0] &= _top(first, position[0], nstocks)
+    entry_price = np.where(hold[:, 0], price[0], np.nan)
+    entries = entry.sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ### 日內觸發: 首日進場後當日即可出場
+        if trigger is not None and hold.shape[1] > 2:
+            hold[:, 1] &= ~trigger(0, hold[:, 0], hold[:, 0], entry_price, take_profit, stop_loss)
+        for i in range(1, hold.shape[1]-1):
+            row = hold[:, i]
+            row &= hold[:, i-1] | entry[i]
+            count = row.sum(axis=1)
+            for p in np.flatnonzero(count > nstocks):
+                now = int(count[p] - entries[i])
+                row[p] &= (_top(ranking[i-1], entry[i], nstocks-now) if order is None else _pick(order[i-1], entry[i], nstocks-now)) | ~entry[i]
+            new = entry[i] & row
+            entry_price[new] = np.broadcast_to(price[i], new.shape)[new]
+            if trigger is None:
+                ratio = np.where(row, price[i] / entry_price, np.nan)
+                hold[:, i+1] &= ~((ratio > 1 + take_profit) | (ratio < 1 - stop_loss))
+            else:
+                hold[:, i+1] &= ~trigger(i, row, new, entry_price, take_profit, stop_loss)
+
+    return hold
+
+
+def _gather(data: pd.DataFrame, calendar, own: pd.DatetimeIndex, labels: pd.DatetimeIndex, columns: pd.Index, freq):
+    """
+    以交易日曆索引取出各調倉日當時的條件 (沿用前一筆資料，不在該表調倉日者為 False)
+    """
+    rows = calendar.last(freq)
+    if own is not labels:
+        loc = own.get_indexer(labels)
+        rows = np.where(loc >= 0, rows[np.maximum(loc, 0)], -1)
+    arr = data.values[np.ix_(np.maximum(rows, 0), data.columns.get_indexer(columns))]
+    if arr.dtype != bool:
+        arr = np.asarray(arr == True, dtype=bool)
+    arr[rows < 0] = False
+    return arr
+
+
+def _cells(data: pd.DataFrame, index: pd.Index, columns: pd.Index):
+    """
+    對齊日期與標的後的取值函式: 只取出需要的格子，不產生整張對齊表
+    get(row, col, lag): 對齊後第 row 列、第 col 欄在原始資料中前 lag 列的值 (同 shift(lag) 後對齊，缺少者為 NaN)
+    """
+    values = data.values
+    rows = data.index.get_indexer(index)
+    cols = data.columns.get_indexer(columns)
+
+    def get(row: np.ndarray, col: np.ndarray, lag: int = 0):
+        source, column = rows[row] - lag, cols[col]
+        valid = (rows[row] >= 0) & (source >= 0) & (column >= 0)
+        out = np.full(len(source), np.nan, dtype=values.dtype if values.dtype.kind == 'f' else float)
+        out[valid] = values[source[valid], column[valid]]
+        return out
+    return get
+
+
+def _intervals(position: np.ndarray):
+    """
+    持有區間 (稀疏表示): 各段連續持有的 (欄位, 開始列, 結束列 (不含))，以及每日部位總和 (0/1 部位即持有檔數)
+    只走訪非零的格子，記憶體與持有筆數成正比
+    """
+    col, row = np.nonzero(position.T)
+    count = np.bincount(row, weights=position[row, col].astype(float), minlength=position.shape[0])
+    cut = np.flatnonzero((np.diff(col) != 0) | (np.diff(row) != 1)) + 1
+    first = np.concatenate([[0], cut]).astype(np.intp)
+    last = np.concatenate([cut - 1, [len(row) - 1]]).astype(np.intp)
+    if len(row) == 0:
+        first = last = np.zeros(0, dtype=np.intp)
+    return col[first], row[first], row[last] + 1, count
 
 
 class QuantBacktest:
@@ -22,12 +144,20 @@ class QuantBacktest:
     sim(): 模擬回測績效並產生各類報表
     bestsim(): 對多個進出場條件進行最佳化
     optimize(): 對特定條件進行最佳化
+    sweep(): 批次評估多組停利/停損組合
+    live(): 可逐日續算的回測狀態
+    walkforward(): 滾動樣本內最佳化、樣本外驗證
     """
     
-    def __init__(self, trade_price: QuantDataFrame, freq: str, nstocks: int, rank: QuantDataFrame, take_profit: float, stop_loss: float, fee: float, tax: float, rf: float):
+    def __init__(self, trade_price: QuantDataFrame, freq: str, nstocks: int, rank: QuantDataFrame, take_profit: float, stop_loss: float, fee: float, tax: float, rf: float, engine: str = 'numpy', benchmark=BENCHMARK, bars: QuantBars = None, entry: str = 'open'):
         """
-        進出場價格、調倉頻率、持有檔數上限、停利條件、停損條件、手續費、交易稅、無風險利率
+        進出場價格、調倉頻率、持有檔數上限、停利條件、停損條件、手續費、交易稅、無風險利率、部位計算引擎、基準指數、日內 K 棒、進場時點
         """
+        assert engine in ['numpy', 'pandas', 'intraday'], 'No such engine for strategy'
+        assert engine != 'intraday' or bars is not None, 'Intraday engine needs QuantBars'
+        assert entry in ['open', 'close'], 'Entry must be open or close'
+        ### intraday 引擎: 開盤進場時進場日的 K 棒即參與停利停損判斷，收盤進場時自隔日開始判斷 (不使用進場前的 K 棒)
+
         self.trade_price = trade_price
         self.freq = freq
         self.nstocks = nstocks
@@ -37,174 +167,355 @@ class QuantBacktest:
         self.fee = fee
         self.tax = tax
         self.rf = rf
+        self.engine = engine
+        self.benchmark = benchmark
+        self.bars = bars
+        self.entry = entry
+        self._taiex = None
+        self._aligned = None
+        ### 回測區間 (起日, 迄日)，None 為完整期間 (walkforward() 以此將各區間限制在自己的交易日內)
+        self.period = None
+
+    def _price(self):
+        """
+        回測區間內的進出場價格
+        """
+        price = self.trade_price.data
+        if self.period is not None:
+            price = price.loc[self.period[0]:self.period[1]]
+        return price
+
+    def _signal(self, entry: QuantDataFrame, exit: QuantDataFrame = None, close: bool = True):
+        """
+        對齊進出場條件、排名與價格 (停損停利與持有上限之前的共同前處理)
+        close: 最後一日全部出場
+        """
+        with span('signal.evaluate'):
+            evaluate(entry, exit, self.rank, self.trade_price)
+
+        if exit == None:
+            exit = QuantDataFrame(pd.DataFrame(True, index=entry.data.index, columns=entry.data.columns))
 
+        if self.rank == None:
+            self.rank = QuantDataFrame(pd.DataFrame(1, index=entry.data.index, columns=entry.data.columns))
+
+        price = self._price()
+
+        ### 進出場條件: 以交易日曆索引取出各調倉日當時的條件 (不需 resample / reindex)
+        with span('signal.calendar', entry=entry, exit=exit):
+            entry_cal, exit_cal = universe.calendar(entry.data.index), universe.calendar(exit.data.index)
+            entry_labels, exit_labels = entry_cal.labels(self.freq), exit_cal.labels(self.freq)
+            labels = entry_labels if entry_labels.equals(exit_labels) else entry_labels.union(exit_labels)
+            signal_col = entry.data.columns.intersection(exit.data.columns)
+            entries = _gather(entry.data, entry_cal, entry_labels, labels, signal_col, self.freq)
+            exits = _gather(exit.data, exit_cal, exit_labels, labels, signal_col, self.freq)
+
+            ### 最後一次進出場事件為進場者持有 (同時出現時進場優先)
+            event = np.where(entries | exits, np.arange(len(labels), dtype=np.int32)[:, None], -1)
+            np.maximum.accumulate(event, axis=0, out=event)
+            state = np.take_along_axis(entries, np.maximum(event, 0), axis=0) & (event >= 0)
+        with span('signal.reindex', price=price) as record:
+            ### 每個交易日沿用所屬調倉日的部位，並於隔日生效 (自訂日期持有至最後一個交易日)
+            price_cal = universe.calendar(price.index)
+            if labels.equals(price_cal.labels(self.freq)):
+                bucket = price_cal.bucket(self.freq)
+            else:
+                bucket = np.searchsorted(labels.values, price.index.values, 'right') - 1
+            end = labels[-1] if isinstance(self.freq, str) else max(labels[-1], price.index[-1])
+            rows = np.flatnonzero((bucket >= 0) & (price.index <= end))
+            intersect_col = signal_col.intersection(price.columns)
+            hold = np.zeros((len(rows), len(intersect_col)), dtype=bool)
+            hold[1:] = state[np.ix_(bucket[rows[:-1]], signal_col.get_indexer(intersect_col))]
+            held = np.flatnonzero(hold.any(axis=1))
+            if len(held) == 0:
+                raise _NoSignal()
+            first = held[0]
+            hold, rows = hold[first:], rows[first:]
+            if close:
+                hold[-1] = False
+            position = pd.DataFrame(hold.astype(np.int8), index=price.index[rows], columns=intersect_col)
+            record.shape(position=position)
+
+        ### 停損停利條件 & 排名篩選條件
+        if self.nstocks == None:
+            self.nstocks = len(position.columns)
+
+        with span('signal.ranking', rank=self.rank):
+            ranking, temp = self._ranks(position.index, position.columns)
+            finite = ranking[~np.isnan(ranking)]
+            max_rank = finite.max() if finite.size else np.nan
+            min_rank = finite.min() if finite.size else np.nan
+            with np.errstate(invalid='ignore', divide='ignore'):
+                ranking = (ranking - min_rank) / (max_rank - min_rank)
+            ranking = pd.DataFrame(np.where(np.isnan(ranking), 0, ranking), index=position.index, columns=position.columns)
+        with span('signal.price'):
+            price_arr = price.values[np.ix_(rows, price.columns.get_indexer(intersect_col))]
+            entry = np.zeros_like(hold)
+            entry[1:] = hold[1:] & ~hold[:-1]
+
+        return position, entry, ranking, price_arr, temp
+
+    def _ranks(self, index: pd.DatetimeIndex, columns: pd.Index):
+        """
+        各交易日當時的排名 (沿用前一筆資料)，以及第一個交易日前一日的排名
+        """
+        ranking = self.rank.data
+        dates = ranking.index.values
+        rows = np.searchsorted(dates, index.values, 'right') - 1
+        cols = ranking.columns.get_indexer(columns)
+        values = ranking.values[np.ix_(np.maximum(rows, 0), np.maximum(cols, 0))].astype(float)
+        values[rows < 0] = np.nan
+        values[:, cols < 0] = np.nan
+
+        ### 前一日的排名 (第一個交易日即為排名首日時沿用最後一筆)
+        if ranking.index[0] <= index[0] <= ranking.index[-1]:
+            row = len(dates) - 1 if index[0] == ranking.index[0] else np.searchsorted(dates, (index[0] - pd.Timedelta(days=1)).to_datetime64(), 'right') - 1
+            temp = pd.Series(ranking.values[row, np.maximum(cols, 0)].astype(float), index=columns)
+            temp[cols < 0] = np.nan
+        else:
+            temp = pd.Series(0.0, index=columns)
+        return values, temp
+
+    @traced('strategy')
     def strategy(self, entry: QuantDataFrame, exit: QuantDataFrame = None):
         """
         產生每日持有部位表
         """
+        price = self._price()
         try:
-            if exit == None:
-                exit = QuantDataFrame(pd.DataFrame(True, index=entry.data.index, columns=entry.data.columns))
-
-            if self.rank == None:
-                self.rank = QuantDataFrame(pd.DataFrame(1, index=entry.data.index, columns=entry.data.columns))
-
-            price = self.trade_price.data
-            ranking = self.rank.data
-
-            ### 進出場條件
-            entries = entry.data.resample(self.freq).ffill()
-            exits = exit.data.resample(self.freq).ffill()
-            union_index = entries.index.union(exits.index)
-            intersect_col = entries.columns.intersection(exits.columns)
-            entries = entries.reindex(index=union_index, columns=intersect_col, fill_value=False)
-            exits = exits.reindex(index=union_index, columns=intersect_col, fill_value=False)
-            entries = entries.astype(int).replace(0, np.nan)
-            exits = exits.astype(int).replace(0, np.nan).replace(1, 0)
-            position = entries.copy()
-            position.update(exits, overwrite=False)
-            position = position.ffill().fillna(0)
-            position = position.resample('D').ffill()
-            intersect_index = position.index.intersection(price.index)
-            intersect_col = position.columns.intersection(price.columns)
-            position = position.reindex(index=intersect_index, columns=intersect_col)
-            position = position.shift(1).fillna(0)
-            index = position[position.sum(axis=1) != 0].index[0]
-            position = position.loc[index:]
-            position.iloc[-1] = 0
-
-            ### 停損停利條件 & 排名篩選條件
-            if self.nstocks == None:
-                self.nstocks = len(position.columns)
-
-            ranking = ranking.resample('D').ffill()
-            ranking = ranking.reindex(columns=position.columns).astype(float)
-            temp = ranking.iloc[ranking.index.tolist().index(position.index[0])-1] if position.index[0] in ranking.index.tolist() else position.iloc[0].replace(1, 0)
-            ranking = ranking.reindex_like(position, method='ffill')
-            max_rank = ranking.max().max()
-            min_rank = ranking.min().min()
-            ranking = pd.DataFrame((ranking - min_rank) / (max_rank - min_rank)).fillna(0)
-            price = price.reindex_like(position)
-            price_arr = np.array(price)
-            entry = np.array((position != 0) & (position.shift(1) == 0))
-            waiting = temp[position.values[0] == 1].nlargest(self.nstocks).reindex_like(temp).notna()
-            position.iloc[0][~waiting] = 0
-            entry_price = np.full(position.shape[1], np.nan)
-            entry_price[position.values[0] == 1] = price_arr[0][position.values[0] == 1]
-
-            for i in range(1, position.shape[0]-1):
-                position.iloc[i][(position.iloc[i-1] == 0) & (entry[i] == False)] = 0
-                if position.iloc[i].sum() > self.nstocks:
-                    now = int(position.iloc[i].sum() - sum(entry[i]))
-                    waiting = ranking.iloc[i-1][entry[i] == True]
-                    waiting = waiting.nlargest(self.nstocks-now).reindex_like(ranking.iloc[i]).notna()
-                    position.iloc[i][(~waiting) & (entry[i] == True)] = 0
-                entry_price[(entry[i] == True) & (position.values[i] == 1)] = price_arr[i][(entry[i] == True) & (position.values[i] == 1)]          
-                temp = np.full(position.shape[1], np.nan)
-                temp[position.values[i] == 1] = price_arr[i][position.values[i] == 1] / entry_price[position.values[i] == 1]
-                position.iloc[i+1][(temp > 1 + self.take_profit) | (temp < 1 - self.stop_loss)] = 0
+            position, entry, ranking, price_arr, temp = self._signal(entry, exit)
+
+            if self.engine in ['numpy', 'intraday']:
+                with span('strategy.hold', position=position):
+                    fills = []
+                    trigger = self.bars.trigger(position.index, position.columns, fills, self.entry) if self.engine == 'intraday' else None
+                    hold = _hold(np.array(position) == 1, entry, np.array(ranking), price_arr, np.array(temp, dtype=float), self.nstocks, self.take_profit, self.stop_loss, trigger)
+                    index, columns = position.index, position.columns
+                    position = pd.DataFrame(hold[0].astype(np.int8), index=index, columns=columns)
+                    if trigger is not None:
+                        position.attrs['fills'] = self.bars.fills(fills, index, columns)[0]
+            else:
+                waiting = temp[position.values[0] == 1].nlargest(self.nstocks).reindex_like(temp).notna()
+                position.iloc[0][~waiting] = 0
+                entry_price = np.full(position.shape[1], np.nan)
+                entry_price[position.values[0] == 1] = price_arr[0][position.values[0] == 1]
+
+                for i in range(1, position.shape[0]-1):
+                    position.iloc[i][(position.iloc[i-1] == 0) & (entry[i] == False)] = 0
+                    if position.iloc[i].sum() > self.nstocks:
+                        now = int(position.iloc[i].sum() - sum(entry[i]))
+                        waiting = ranking.iloc[i-1][entry[i] == True]
+                        waiting = waiting.nlargest(self.nstocks-now).reindex_like(ranking.iloc[i]).notna()
+                        position.iloc[i][(~waiting) & (entry[i] == True)] = 0
+                    entry_price[(entry[i] == True) & (position.values[i] == 1)] = price_arr[i][(entry[i] == True) & (position.values[i] == 1)]          
+                    temp = np.full(position.shape[1], np.nan)
+                    temp[position.values[i] == 1] = price_arr[i][position.values[i] == 1] / entry_price[position.values[i] == 1]
+                    position.iloc[i+1][(temp > 1 + self.take_profit) | (temp < 1 - self.stop_loss)] = 0
                 
-        except:
+        except _NoSignal:
             print(f'There is NO entry signal!\n')
-            position = pd.DataFrame(0, index=price.index, columns=price.columns)
+            position = pd.DataFrame(0, index=price.index, columns=price.columns, dtype=np.int8)
 
         return position   
     
 
+    @traced('sim')
     def sim(self, position: pd.DataFrame):
         """
         模擬回測績效並產生各類報表
         """
-        price = self.trade_price.data
-        weight = position.div(position.sum(axis=1), axis=0).fillna(0)
-        weight = weight.shift(1).fillna(0)
-        weight_arr = np.array(weight)
-        payoff = (price - price.shift(1)).reindex(index=position.index, columns=position.columns)
-        payoff_arr = np.array(payoff)
-        price = price.reindex_like(position)
-        price_arr = np.array(price)
-        entry_price = np.full(position.shape[1], np.nan)
-        entry_price[position.values[0] == 1] = price_arr[0][position.values[0] == 1]
-        entry_date = np.full(position.shape[1], '0000-00-00')
-        entry_date[position.values[0] == 1] = str(position.index[0])
-        entry = (position != 0) & (position.shift(1) == 0)
-        exit = (position == 0) & (position.shift(1) != 0) 
-        asset_list = []
-        entry_date_list = []
-        exit_date_list = []
-        entry_price_list = []
-        exit_price_list = []
-        weight_list = []
-        ret_list = []
-
-        for i in range(1, position.shape[0]):
-            entry_date[entry.values[i]] = str(entry.index[i])
-            entry_price[entry.values[i]] = price_arr[i][entry.values[i]]
-            payoff_arr[i] = payoff_arr[i] / entry_price
-            payoff_arr[i][entry.values[i-1]] = payoff_arr[i][entry.values[i-1]] - self.fee
-            payoff_arr[i][exit.values[i]] = payoff_arr[i][exit.values[i]] - self.fee - self.tax
-            temp = (price_arr[i][exit.values[i]] / entry_price[exit.values[i]] - 1 - 2 * self.fee - self.tax) * weight_arr[i][exit.values[i]]
-            asset_list = np.append(asset_list, exit.columns[exit.values[i]])
-            entry_date_list = np.append(entry_date_list, entry_date[exit.values[i]])
-            exit_date_list = np.append(exit_date_list, np.full(sum(exit.values[i]), str(exit.index[i])[:10]))
-            entry_price_list = np.append(entry_price_list, entry_price[exit.values[i]])
-            exit_price_list = np.append(exit_price_list, price_arr[i][exit.values[i]])
-            weight_list = np.append(weight_list, weight_arr[i][exit.values[i]])
-            ret_list = np.append(ret_list, temp)
-
-        trade_table = pd.DataFrame({
-            'Asset': asset_list, 
-            'Entry Date': entry_date_list, 
-            'Exit Date': exit_date_list, 
-            'Entry Price': entry_price_list, 
-            'Exit Price': exit_price_list, 
-            'Weight': weight_list, 
-            'Return': ret_list}
-        )
-        payoff = pd.DataFrame(payoff_arr*weight_arr, index=payoff.index, columns=payoff.columns).fillna(0)
-        payoff_table = pd.DataFrame()
-        payoff_table['Strategy'] = payoff.sum(axis=1)
-        taiex = pd.read_feather('/Users/kuanhsu/Desktop/code/Python/FILE/報酬指數.ftr')
-        taiex = taiex.set_index('datetime', drop=True)
-        taiex.index = pd.to_datetime(taiex.index)
-        taiex = taiex.reindex(weight.index)
-        taiex['Payoff'] = (taiex.Close - taiex.Close.shift(1)) / taiex.Close[0]
-        taiex = taiex.fillna(0)
-        payoff_table['Benchmark'] = taiex.Payoff.values
-        equity_table = payoff_table.cumsum() + 1
-        hold_table = position.sum(axis=1)
-        return QuantReport(payoff_table, equity_table, trade_table, hold_table, self.rf)
+        with span('sim.align', position=position):
+            price = _override(_cells(self.trade_price.data, position.index, position.columns), position)
+        with span('sim.benchmark'):
+            benchmark = self._benchmark(position.index)
+        return self._sim(position, price, benchmark)
+
+    def _sim(self, position: pd.DataFrame, price, benchmark: np.ndarray):
+        """
+        以持有區間 (稀疏表示) 計算各類報表，記憶體與時間隨持有筆數增加，與標的總數無關
+        price: 對齊後價格的取值函式 (_cells)
+        """
+        n = len(position)
+        values = np.asarray(position)
+        with span('sim.intervals', position=position):
+            col, start, end, count = _intervals(values)
+            filled = _filled(position, col, end)
+
+        ### 每日報酬: 權重為前一日部位佔部位總和的比例 (0/1 部位即均分)，成本前損益與進出場權重分開累計 (resim() 只需重算成本)
+        ### 日內觸發出場者，最後一段報酬與成本計入觸發當日 (出場列的前一列)
+        with span('sim.payoff'):
+            stop = np.minimum(end, n-1)
+            length = np.maximum(stop - start, 0)
+            cell = np.repeat(np.arange(len(col)), length)
+            row = np.arange(len(cell)) - np.repeat(np.cumsum(length) - length, length) + start[cell] + 1
+            with np.errstate(divide='ignore', invalid='ignore'):
+                value = (price(row, col[cell]) - price(row, col[cell], 1)) / price(start, col)[cell]
+                weight = values[row-1, col[cell]] / count[row-1]
+            valid = ~np.isnan(value)
+            book = row - (filled[cell] & (row == end[cell]))
+            gross = {
+                'payoff': np.bincount(book, weights=np.where(valid, value * weight, 0), minlength=n),
+                'entry': np.bincount(book, weights=weight * (valid & (row == start[cell] + 1) & (start[cell] >= 1)), minlength=n),
+                'exit': np.bincount(book, weights=weight * (valid & (row == end[cell])), minlength=n),
+            }
+
+        ### 逐筆交易明細 (依出場日、標的排序，日內觸發出場者的出場日為觸發當日)
+        with span('sim.ledger'):
+            trade = np.flatnonzero(end < n)
+            trade = trade[np.lexsort((col[trade], end[trade] - filled[trade]))]
+            entry_row, exit_row, asset = start[trade], end[trade], col[trade]
+            weight = values[exit_row-1, asset] / count[exit_row-1]
+            entry_price, exit_price = price(entry_row, asset), price(exit_row, asset)
+            gross['ratio'], gross['weight'] = exit_price / entry_price, weight
+            trade_table = pd.DataFrame({
+                'Asset': position.columns.values[asset], 
+                'Entry Date': position.index.values[entry_row], 
+                'Exit Date': position.index.values[exit_row - filled[trade]], 
+                'Entry Price': entry_price, 
+                'Exit Price': exit_price, 
+                'Weight': weight, 
+                'Return': (gross['ratio'] - 1 - 2 * self.fee - self.tax) * weight}
+            )
+
+        ### 報表
+        with span('sim.tables'):
+            payoff_table = pd.DataFrame(index=position.index)
+            payoff_table['Strategy'] = gross['payoff'] - self.fee * gross['entry'] - (self.fee + self.tax) * gross['exit']
+            payoff_table['Benchmark'] = benchmark
+            equity_table = payoff_table.cumsum() + 1
+            hold_table = position.sum(axis=1)
+        return QuantReport(payoff_table, equity_table, trade_table, hold_table, self.rf, dict(gross, fee=self.fee, tax=self.tax))
+
+    def live(self, entry: QuantDataFrame, exit: QuantDataFrame = None):
+        """
+        以目前的歷史資料建立可續算的回測狀態 (僅支援每日調倉)，之後以 update() 附加新的交易日
+        """
+        return QuantLive(self, entry, exit)
+
+    def _load_benchmark(self):
+        """
+        讀取基準指數 (僅讀取一次)，回傳含 Close 欄位的 pd.DataFrame，無基準指數時回傳 None
+        benchmark: 檔案路徑 (Feather)、價格序列 (pd.Series / 含 Close 的 pd.DataFrame)、回傳前述資料的函式或 None
+        """
+        if self._taiex is None and self.benchmark is not None:
+            taiex = self.benchmark() if callable(self.benchmark) else self.benchmark
+            assert taiex is not None, 'Benchmark provider returned no data'
+            if isinstance(taiex, str):
+                assert os.path.exists(taiex), f'Benchmark file not found: {taiex}'
+                taiex = pd.read_feather(taiex)
+                taiex = taiex.set_index('datetime', drop=True)
+            if isinstance(taiex, pd.Series):
+                taiex = taiex.to_frame('Close')
+            taiex = taiex[['Close']].astype(float)
+            taiex.index = pd.to_datetime(taiex.index)
+            self._taiex = taiex
+        return self._taiex
+
+    def _close(self, index: pd.Index):
+        """
+        對齊日期的基準指數價格 (無基準指數時為缺值)
+        """
+        taiex = self._load_benchmark()
+        if taiex is None:
+            return pd.Series(np.nan, index=index)
+        return taiex.Close.reindex(index)
+
+    def _benchmark(self, index: pd.Index):
+        """
+        基準指數每日報酬 (相同日期的結果只計算一次)
+        """
+        if self._aligned is not None and self._aligned[0].equals(index):
+            return self._aligned[1].copy()
+        if self._load_benchmark() is None:
+            payoff = np.zeros(len(index))
+        else:
+            close = self._close(index)
+            payoff = ((close - close.shift(1)) / close.iloc[0]).fillna(0).values
+        self._aligned = (index, payoff)
+        return payoff.copy()
+
+    def sweep(self, entry: QuantDataFrame, exit: QuantDataFrame = None, pairs: list = None, batch: int = 50):
+        """
+        一次評估多組停利/停損組合，回傳各組合的回測數據
+        pairs: [(停利, 停損), ...]
+        batch: 每批同時計算的組合數 (限制堆疊部位陣列的記憶體)
+        """
+        reports = self._sweep(entry, exit, pairs, batch)
+        result = self._stats(list(reports.values()))
+        result.index = pd.MultiIndex.from_tuples(reports.keys(), names=['Take Profit', 'Stop Loss'])
+        return result
+
+    def _stats(self, reports: list):
+        """
+        以批次計算彙整日期相同的多份報表的回測數據 (Index: 報表順序)
+        """
+        payoff = pd.DataFrame({i: report.payoff_table.Strategy for i, report in enumerate(reports)})
+        trades = pd.concat([report.trade_table[['Return']].assign(Strategy=i) for i, report in enumerate(reports)])
+        return batch_stats(payoff, trades, self.rf, reports[0].payoff_table.Benchmark)
+
+    def _sweep(self, entry: QuantDataFrame, exit: QuantDataFrame = None, pairs: list = None, batch: int = 50, limits: list = None):
+        """
+        共用前處理與排名順序索引後，對多組停利/停損組合 (及持有檔數上限) 堆疊計算部位並模擬回測
+        limits: 持有檔數上限的候選值，不為 None 時以 (上限, 停利, 停損) 為鍵
+        """
+        if pairs == None:
+            pairs = [(0.20, 0.10), (0.20, 0.05), (0.10, 0.05), (np.inf, 0.10), (np.inf, 0.05), (np.inf, np.inf)]
+
+        price = self._price()
+        keys = [tuple(pair) for pair in pairs] if limits == None else [(limit,) + tuple(pair) for limit in limits for pair in pairs]
+        try:
+            position, entry, ranking, price_arr, temp = self._signal(entry, exit)
+            signal = np.array(position) == 1
+            ranking = np.array(ranking)
+            order = _order(ranking)
+            temp = np.array(temp, dtype=float)
+            holds, fills = [], []
+            for limit in ([self.nstocks] if limits == None else limits):
+                limit = position.shape[1] if limit == None else limit
+                for i in range(0, len(pairs), batch):
+                    take_profit, stop_loss = zip(*pairs[i:i+batch])
+                    records = []
+                    trigger = self.bars.trigger(position.index, position.columns, records, self.entry) if self.engine == 'intraday' else None
+                    holds.extend(_hold(signal, entry, ranking, price_arr, temp, limit, take_profit, stop_loss, trigger, order))
+                    fills.extend(self.bars.fills(records, position.index, position.columns, len(take_profit)) if trigger is not None else [None] * len(take_profit))
+        except _NoSignal:
+            print(f'There is NO entry signal!\n')
+            position = pd.DataFrame(0, index=price.index, columns=price.columns, dtype=np.int8)
+            holds, fills = [np.array(position) == 1] * len(keys), [None] * len(keys)
+
+        price = _cells(price, position.index, position.columns)
+        benchmark = self._benchmark(position.index)
+        reports = {}
+        for key, hold, fill in zip(keys, holds, fills):
+            position = pd.DataFrame(hold.astype(np.int8), index=position.index, columns=position.columns)
+            if fill is not None:
+                position.attrs['fills'] = fill
+            reports[key] = self._sim(position, _override(price, position), benchmark)
+        return reports
     
 
-    def bestsim(self, entry: list, exit: list = None, label: list = None):
+    def bestsim(self, entry: list, exit: list = None, label: list = None, n_jobs: int = 1):
         """
         對多個進出場條件組合進行最佳化
+        n_jobs: 平行運算的進程數 (-1 為使用全部核心)
         """
         if exit == None:
             exit = [None] * len(entry)
         if label == None:
             label = ['cond '+str(i+1) for i in list(range(len(entry)))]
 
-        cond_list = list(zip(entry, exit))
-        plt.style.use('bmh')
-        plt.figure(figsize=(12, 6), dpi=200)
-        plt.ylabel('Equity')
-        plt.xlabel('Time')
-        plt.title('進出場條件 - 最佳化', fontsize=16)
-        for i in range(len(cond_list)):
-            position = self.strategy(cond_list[i][0], cond_list[i][1])
-            report = self.sim(position)
-            plt.plot(report.equity_table.Strategy, label=label[i])
-        plt.legend()
-        plt.show()
+        tasks = [({}, entry[i], exit[i]) for i in range(len(entry))]
+        results = [result[0] for result in parallel.run(self, tasks, n_jobs)]
+        return self._compare('進出場條件 - 最佳化', label, results)
 
 
-    def optimize(self, type: str, entry: QuantDataFrame, exit: QuantDataFrame = None):
+    def optimize(self, type: str, entry: QuantDataFrame, exit: QuantDataFrame = None, n_jobs: int = 1):
         """
         對特定條件進行最佳化
         'stop': 停利/停損
         'nstocks': 持有檔數上限
         'freq': 調倉頻率
+        n_jobs: 平行運算的進程數 (-1 為使用全部核心)
         """
 
         assert type in ['stop', 'nstocks', 'freq'], 'No such type for optimization'
@@ -212,48 +523,108 @@ class QuantBacktest:
         if type == 'stop':
             pair_list = [(0.20, 0.10), (0.20, 0.05), (0.10, 0.05), (np.inf, 0.10), (np.inf, 0.05), (np.inf, np.inf)]
             label_list = [('20%', '10%'), ('20%', ' 5%'), ('10%', ' 5%'), ('  X', '10%'), ('  X', ' 5%'), ('  X', '  X')]
-            plt.style.use('bmh')
-            plt.figure(figsize=(12, 6), dpi=200)
-            plt.ylabel('Equity')
-            plt.xlabel('Time')
-            plt.title('停利/停損組合 - 最佳化', fontsize=16)
-            for i in range(len(pair_list)):
-                self.take_profit = pair_list[i][0]
-                self.stop_loss = pair_list[i][1]
-                position = self.strategy(entry, exit)
-                report = self.sim(position)
-                plt.plot(report.equity_table.Strategy, label='(停利, 停損) = ('+str(label_list[i][0])+', '+str(label_list[i][1])+')')
-            plt.legend()
-            plt.show()
+            size = -(-len(pair_list) // parallel.workers(n_jobs))
+            tasks = [({}, entry, exit, pair_list[i:i+size]) for i in range(0, len(pair_list), size)]
+            results = [result for results in parallel.run(self, tasks, n_jobs) for result in results]
+            label = ['(停利, 停損) = ('+str(label_list[i][0])+', '+str(label_list[i][1])+')' for i in range(len(pair_list))]
+            return self._compare('停利/停損組合 - 最佳化', label, results)
 
         if type == 'nstocks':
             num_list = [5, 10, 20, 50, 100, None]
             label_list = ['5', '10', '20', '50', '100', 'NO']
-            plt.style.use('bmh')
-            plt.figure(figsize=(12, 6), dpi=200)
-            plt.ylabel('Equity')
-            plt.xlabel('Time')
-            plt.title('持有檔數上限 - 最佳化', fontsize=16)
-            for i in range(len(num_list)):
-                self.nstocks = num_list[i]
-                position = self.strategy(entry, exit)
-                report = self.sim(position)
-                plt.plot(report.equity_table.Strategy, label='持有檔數上限 = '+str(label_list[i]))
-            plt.legend()
-            plt.show()
+            size = -(-len(num_list) // parallel.workers(n_jobs))
+            tasks = [({}, entry, exit, [(self.take_profit, self.stop_loss)], False, num_list[i:i+size]) for i in range(0, len(num_list), size)]
+            results = [result for results in parallel.run(self, tasks, n_jobs) for result in results]
+            label = ['持有檔數上限 = '+str(label_list[i]) for i in range(len(num_list))]
+            return self._compare('持有檔數上限 - 最佳化', label, results)
 
         if type == 'freq':
             str_list = ['D', 'W', 'M', 'Q', 'Y']
             label_list = ['日', '週', '月', '季', '年']
-            plt.style.use('bmh')
-            plt.figure(figsize=(12, 6), dpi=200)
-            plt.ylabel('Equity')
-            plt.xlabel('Time')
-            plt.title('調倉頻率 - 最佳化', fontsize=16)
-            for i in range(len(str_list)):
-                self.freq = str_list[i]
-                position = self.strategy(entry, exit)
-                report = self.sim(position)
-                plt.plot(report.equity_table.Strategy, label='調倉頻率 = '+str(label_list[i]))
-            plt.legend()
-            plt.show()
+            tasks = [({'freq': str_list[i]}, entry, exit) for i in range(len(str_list))]
+            results = [result[0] for result in parallel.run(self, tasks, n_jobs)]
+            label = ['調倉頻率 = '+str(label_list[i]) for i in range(len(str_list))]
+            return self._compare('調倉頻率 - 最佳化', label, results)
+
+
+    def walkforward(self, entry: QuantDataFrame, exit: QuantDataFrame = None, grid: dict = None, train: int = 252, test: int = 63, anchored: bool = False, metric: str = 'Sharpe Ratio', n_jobs: int = 1):
+        """
+        前進式最佳化: 將交易日切為訓練/測試區間，於訓練區間選出 metric 最佳的參數，再以該參數回測測試區間
+        回傳 (各區間的參數與績效, 串接各測試區間的 QuantReport)
+        grid: 候選參數 {'nstocks': [...], 'freq': [...], 'take_profit': [...], 'stop_loss': [...]}，預設為 optimize('nstocks') 的六組
+        train, test: 訓練與測試區間的交易日數
+        anchored: True 時訓練區間固定自第一天開始 (逐步擴大)，False 時為固定長度的滾動區間
+        metric: stats() 的欄位，MDD、波動度等越小越好的欄位取最小值
+        n_jobs: 平行運算的進程數 (-1 為使用全部核心)
+        """
+        assert all(key in ['nstocks', 'freq', 'take_profit', 'stop_loss'] for key in (grid or {})), 'No such parameter for walk-forward'
+
+        if grid == None:
+            grid = {'nstocks': [5, 10, 20, 50, 100, None]}
+        settings = [dict(zip(grid.keys(), values)) for values in itertools.product(*grid.values())]
+
+        ### 進出場條件只計算一次，各區間取其切片
+        evaluate(entry, exit, self.rank, self.trade_price)
+        dates = entry.data.index.intersection(self.trade_price.data.index)
+        window = lambda frame, a, b: QuantDataFrame(frame.data.loc[dates[a]:dates[b-1]]) if frame is not None else None
+        folds = []
+        for start in range(0, len(dates) - train, test):
+            a = 0 if anchored else start
+            folds.append((a, start + train, min(start + train + test, len(dates))))
+
+        ### 各區間的價格與部位限制在自己的交易日內，並於區間最後一日全部出場 (不使用下一個區間的資料)
+        period = lambda setting, a, b: dict(setting, period=(dates[a], dates[b-1]))
+
+        ### 訓練區間: 所有區間 × 候選參數一次平行計算
+        tasks = [(period(setting, a, b), window(entry, a, b), window(exit, a, b)) for a, b, c in folds for setting in settings]
+        scores = np.array([pd.to_numeric(result[0][0][metric], errors='coerce') for result in parallel.run(self, tasks, n_jobs)], dtype=float)
+        scores = scores.reshape(len(folds), len(settings))
+        lower = metric in ['Volatility [%]', 'MDD [%]', 'MDD Duration [days]']
+        best = [int(np.nanargmin(row) if lower else np.nanargmax(row)) if not np.isnan(row).all() else 0 for row in scores]
+
+        ### 測試區間: 以各區間最佳參數回測
+        tasks = [(period(settings[k], b, c), window(entry, b, c), window(exit, b, c), None, True) for (a, b, c), k in zip(folds, best)]
+        reports = [result[0] for result in parallel.run(self, tasks, n_jobs)]
+
+        table = []
+        payoff, trade, hold = [], [], []
+        for (a, b, c), k, report in zip(folds, best, reports):
+            ### 對齊測試區間的每個交易日 (部位表自第一個進場訊號開始，無訊號時為整個區間)
+            period = report.payoff_table.reindex(dates[b:c])
+            period['Strategy'] = period.Strategy.fillna(0)
+            period['Benchmark'] = self._benchmark(dates[b:c])
+            payoff.append(period)
+            trade.append(report.trade_table)
+            hold.append(report.hold_table.reindex(dates[b:c], fill_value=0))
+            equity = period.Strategy.cumsum() + 1
+            table.append(dict(settings[k], **{
+                'Train Start': dates[a], 'Train End': dates[b-1], 'Test Start': dates[b], 'Test End': dates[c-1],
+                'Train ' + metric: scores[len(table), k], 'Test Return [%]': np.round((equity.iloc[-1] - 1) * 100, 2) if len(equity) else 0.0}))
+
+        payoff_table = pd.concat(payoff)
+        report = QuantReport(payoff_table, payoff_table.cumsum() + 1, pd.concat(trade, ignore_index=True), pd.concat(hold), self.rf)
+        table = pd.DataFrame(table, index=pd.RangeIndex(1, len(table)+1, name='Fold'))
+        for key in grid:
+            table[key] = pd.Series([settings[k][key] for k in best], index=table.index, dtype=object)
+        return table, report
+
+
+    def _compare(self, title: str, label: list, results: list):
+        """
+        繪製各候選策略的淨值走勢並彙整回測數據
+        results: [(回測數據, 淨值走勢)]
+        """
+        plt = pyplot()
+        plt.style.use('bmh')
+        plt.figure(figsize=(12, 6), dpi=200)
+        plt.ylabel('Equity')
+        plt.xlabel('Time')
+        plt.title(title, fontsize=16)
+        for i in range(len(results)):
+            plt.plot(results[i][1], label=label[i])
+        plt.legend()
+        plt.show()
+
+        table = pd.concat([result[0] for result in results], axis=1).T
+        table.index = label
+        return table
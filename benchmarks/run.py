@@ -0,0 +1,163 @@
+''' 效能測試 - 執行與比較
+
+ex.
+    python benchmarks/run.py --scale small --output results.json
+    python benchmarks/run.py --scale small --compare results.json
+'''
+
+import os
+import sys
+import gc
+import importlib.util
+import json
+import time
+import platform
+import argparse
+import subprocess
+import tracemalloc
+
+os.environ.setdefault('MPLBACKEND', 'Agg')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+### 以本目錄的上層 (套件根目錄) 為 BBQuant，不需另外安裝或設定 PYTHONPATH
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if 'BBQuant' not in sys.modules:
+    spec = importlib.util.spec_from_file_location('BBQuant', os.path.join(ROOT, '__init__.py'), submodule_search_locations=[ROOT])
+    sys.modules['BBQuant'] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(sys.modules['BBQuant'])
+
+import numpy as np
+import pandas as pd
+import BBQuant as bbq
+from BBQuant.plotting import pyplot
+import synthetic
+
+
+### 測試規模: 標的數、年數、資料頻率 (分鐘資料另設每日 K 棒數)
+SCALES = {
+    'tiny': dict(n_assets=100, years=2, freq='D'),
+    'small': dict(n_assets=500, years=5, freq='D'),
+    'medium': dict(n_assets=2000, years=10, freq='D'),
+    'large': dict(n_assets=5000, years=20, freq='D'),
+    'minute': dict(n_assets=100, years=1, freq='min', bars=270),
+    'minute-large': dict(n_assets=500, years=5, freq='min', bars=270),
+}
+
+
+def measure(func, repeat: int = 1):
+    """
+    執行時間 (多次取最短) 與峰值記憶體 (tracemalloc，單位 MB)
+    """
+    seconds = []
+    for _ in range(repeat):
+        gc.collect()
+        t = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - t)
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, {'seconds': min(seconds), 'peak_mb': peak / 2**20}
+
+def suite(scale: dict, repeat: int = 1, seed: int = 0, dtype: str = 'float64'):
+    """
+    依序測試資料轉換、指標運算、部位計算、回測模擬、最佳化與績效統計
+    """
+    results = {}
+
+    def run(name, func):
+        value, results[name] = measure(func, repeat)
+        print(f"{name:<12} {results[name]['seconds']:9.3f} s {results[name]['peak_mb']:9.1f} MB", flush=True)
+        return value
+
+    data = synthetic.market(**scale, seed=seed)
+    close = run('get', lambda: bbq.get(data.copy(), 'Close', dtype))
+    open_ = bbq.get(data.copy(), 'Open', dtype)
+    low = bbq.get(data.copy(), 'Low', dtype)
+    run('load', lambda: bbq.load(data, ['Open', 'Low', 'Close'], dtype=dtype))
+    del data
+
+    def chain():
+        ma5, ma10, ma20, ma60 = close.average(5), close.average(10), close.average(20), close.average(60)
+        entry = (ma5 > ma10) & (ma10 > ma20) & (ma20 > ma60) & (low < ma10)
+        exit = ma5 < ma60
+        return entry, exit
+
+    entry, exit = run('operators', chain)
+    run('largest', lambda: close.largest(50))
+    run('rolling', lambda: (close.max(20), close.min(20), close.sustain(5), close.rank(20)))
+
+    backtest = bbq.setting(open_, nstocks=10, rank=-close, stop_loss=0.1, benchmark=synthetic.benchmark(close.data.index, seed))
+    position = run('strategy', lambda: backtest.strategy(entry, exit))
+    report = run('sim', lambda: backtest.sim(position))
+    run('stats', lambda: report.stats())
+    run('sweep', lambda: backtest.sweep(entry, exit))
+    run('optimize', lambda: (backtest.optimize('stop', entry, exit), pyplot().close('all')))
+    return results
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+def compare(current: dict, previous: dict, threshold: float, noise: float = 0.05):
+    """
+    與先前結果比較，回傳變慢超過 threshold 倍的項目 (相差不到 noise 秒者視為誤差)
+    """
+    slower = []
+    print(f"\n{'case':<12} {'before':>9} {'after':>9} {'ratio':>7}")
+    for name, result in current['results'].items():
+        if name not in previous['results']:
+            continue
+        before = previous['results'][name]['seconds']
+        ratio = result['seconds'] / before if before > 0 else np.inf
+        print(f"{name:<12} {before:9.3f} {result['seconds']:9.3f} {ratio:7.2f}")
+        if ratio > threshold and result['seconds'] - before > noise:
+            slower.append(name)
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description='BBQuant benchmark suite')
+    parser.add_argument('--scale', default='small', choices=list(SCALES))
+    parser.add_argument('--assets', type=int, help='override the number of assets')
+    parser.add_argument('--years', type=float, help='override the number of years')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dtype', default='float64', choices=['float64', 'float32'], help='price dtype passed to get/load')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', help='previous JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25, help='fail when a case is this many times slower')
+    args = parser.parse_args()
+
+    scale = dict(SCALES[args.scale])
+    if args.assets:
+        scale['n_assets'] = args.assets
+    if args.years:
+        scale['years'] = args.years
+
+    current = {
+        'commit': commit(),
+        'scale': dict(scale, name=args.scale, seed=args.seed, dtype=args.dtype),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'results': suite(scale, args.repeat, args.seed, args.dtype),
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            slower = compare(current, json.load(f), args.threshold)
+        if slower:
+            print(f'\nslower than {args.threshold}x: {slower}')
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+''' 效能測試 - 合成市場資料 '''
+
+import numpy as np
+import pandas as pd
+
+
+def market(n_assets: int = 500, years: float = 5, freq: str = 'D', bars: int = 270, seed: int = 0, missing: float = 0.02):
+    """
+    以固定亂數種子產生長格式 OHLCV 資料 (datetime, asset, open, high, low, close, volume)
+    n_assets: 標的數
+    years: 年數 (每年 252 個交易日)
+    freq: 'D' 日資料、'min' 分鐘資料
+    bars: 分鐘資料每日的 K 棒數 (自 09:01 起)
+    missing: 隨機缺漏的資料比例 (模擬停牌與上市前後)
+    """
+    assert freq in ['D', 'min'], 'No such frequency for synthetic data'
+
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range('2010-01-04', periods=int(years * 252))
+    if freq == 'D':
+        dates = days
+    else:
+        minutes = pd.to_timedelta(np.arange(1, bars+1) + 9*60, unit='min')
+        dates = pd.DatetimeIndex((days.values[:, None] + minutes.values[None]).ravel())
+    n = len(dates)
+    scale = 0.02 / np.sqrt(1 if freq == 'D' else bars)
+
+    ### 各標的的漂移與波動不同，價格為幾何隨機漫步
+    drift = rng.normal(0.0003, 0.0002, n_assets) / (1 if freq == 'D' else bars)
+    vol = scale * rng.uniform(0.5, 1.5, n_assets)
+    close = 10 + 90 * rng.random(n_assets) * np.exp(np.cumsum(rng.normal(drift, vol, (n, n_assets)), axis=0))
+    open_ = close * np.exp(rng.normal(0, vol / 4, (n, n_assets)))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, vol / 2, (n, n_assets))))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, vol / 2, (n, n_assets))))
+    volume = rng.integers(1, 5000, (n, n_assets)).astype(float)
+
+    data = pd.DataFrame({
+        'datetime': np.repeat(dates.values, n_assets),
+        'asset': np.tile(np.array([str(1101 + i) for i in range(n_assets)]), n),
+        'open': open_.ravel(),
+        'high': high.ravel(),
+        'low': low.ravel(),
+        'close': close.ravel(),
+        'volume': volume.ravel(),
+    })
+    if missing > 0:
+        keep = rng.random(len(data)) >= missing
+        keep[:n_assets] = True
+        data = data[keep].reset_index(drop=True)
+    return data
+
+def benchmark(dates: pd.DatetimeIndex, seed: int = 0):
+    """
+    合成的基準指數價格 (pd.Series，可直接傳入 bbq.setting(benchmark=...))
+    """
+    rng = np.random.default_rng(seed)
+    return pd.Series(10000 * np.exp(np.cumsum(rng.normal(0.0002, 0.01, len(dates)))), index=dates, name='Close')
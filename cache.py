@@ -0,0 +1,113 @@
+''' 多股票量化策略 - 指標快取 '''
+
+import os
+import glob
+import hashlib
+import pandas as pd
+import numpy as np
+
+
+### 指標計算方式改變時調整版本，使舊的快取失效
+VERSION = 1
+
+_active = None
+
+
+class QuantCache:
+    """
+    指標快取: 以運算鏈 (方法名稱與參數) 與輸入資料指紋為鍵，將結果以 Feather 格式存檔
+    輸入資料改變時指紋隨之改變，舊結果自然不再被命中；超過容量時依最近使用時間淘汰
+    """
+
+    def __init__(self, path: str, max_bytes: int = 2**30):
+        """
+        快取目錄、容量上限 (bytes)
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+
+    def key(self, fingerprint: str, method: str, args: tuple, kwargs: dict):
+        """
+        運算鏈的鍵值
+        """
+        text = repr((VERSION, fingerprint, method, [_token(arg) for arg in args], sorted((k, _token(v)) for k, v in kwargs.items())))
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def load(self, key: str, like: pd.DataFrame):
+        """
+        讀取快取結果 (並更新最近使用時間)，不存在時回傳 None
+        like: 輸入資料，用以還原標的名稱與共用的日曆
+        """
+        file = os.path.join(self.path, key + '.ftr')
+        if not os.path.exists(file):
+            return None
+        df = pd.read_feather(file)
+        df = df.set_index(df.columns[0])
+        df.columns = like.columns
+        ### 結果的日期為輸入日期的連續區段時 (ex. diff 刪除前幾列)，以輸入日期的切片還原名稱與頻率，與直接計算的結果相同
+        if df.index.equals(like.index):
+            df.index = like.index
+        else:
+            start = like.index.get_indexer(df.index[:1])[0] if len(df) and like.index.is_unique else 0
+            if start >= 0 and like.index[start:start+len(df)].equals(df.index):
+                df.index = like.index[start:start+len(df)]
+            else:
+                df.index.name = like.index.name
+        os.utime(file)
+        return df
+
+    def save(self, key: str, data: pd.DataFrame):
+        """
+        存入結果，並淘汰最久未使用的檔案直到總容量低於上限
+        """
+        df = data.copy(deep=False)
+        df.columns = [str(column) for column in df.columns]
+        df.index = df.index.rename('datetime')
+        df.reset_index().to_feather(os.path.join(self.path, key + '.ftr'), compression='zstd')
+
+        files = sorted(glob.glob(os.path.join(self.path, '*.ftr')), key=os.path.getmtime)
+        size = sum(os.path.getsize(file) for file in files)
+        while files and size > self.max_bytes:
+            file = files.pop(0)
+            size -= os.path.getsize(file)
+            os.remove(file)
+
+    def clear(self):
+        """
+        清除全部快取
+        """
+        for file in glob.glob(os.path.join(self.path, '*.ftr')):
+            os.remove(file)
+
+
+def _token(arg):
+    """
+    參數的文字表示 (dict / pd.Series 以內容表示)
+    """
+    if isinstance(arg, pd.Series):
+        arg = arg.to_dict()
+    if isinstance(arg, dict):
+        return repr(sorted((repr(k), repr(v)) for k, v in arg.items()))
+    return repr(arg)
+
+def fingerprint(data: pd.DataFrame):
+    """
+    資料指紋: 數值、日期與標的的雜湊
+    """
+    h = hashlib.sha256()
+    h.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+    h.update(pd.util.hash_array(np.asarray(data.columns, dtype=object)).tobytes())
+    h.update(repr(list(data.dtypes.astype(str).unique())).encode())
+    return h.hexdigest()
+
+def use(path: str = None, max_bytes: int = 2**30):
+    """
+    啟用 (或以 None 停用) 指標快取
+    """
+    global _active
+    _active = QuantCache(path, max_bytes) if path is not None else None
+    return _active
+
+def current():
+    return _active
@@ -0,0 +1,240 @@
+''' 多股票量化策略 - 分塊運算 (記憶體映射) '''
+
+import os
+import shutil
+import weakref
+import tempfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from BBQuant.dataframe import QuantDataFrame
+from BBQuant.lazy import LazyQuantDataFrame
+from BBQuant.profiler import span
+
+
+### 需要整列 (全部標的) 的橫斷面運算，其餘運算各標的互相獨立
+CROSS = ['largest', 'smallest', 'rank', 'zscore', 'percentile', 'winsorize', 'neutralize']
+
+### 每批橫斷面運算的元素數
+BLOCK = 1 << 20
+
+
+def store(data: pd.DataFrame, path: str, columns: int = 256):
+    """
+    將表依欄位分塊寫入記憶體映射檔 (.npy，依欄位連續存放)，回傳以該檔為資料的 pd.DataFrame
+    """
+    arr = np.lib.format.open_memmap(path, mode='w+', dtype=np.result_type(*data.dtypes), shape=data.shape, fortran_order=True)
+    for start in range(0, data.shape[1], columns):
+        arr[:, start:start+columns] = data.iloc[:, start:start+columns].values
+    arr.flush()
+    del arr
+    return _open(path, data.index, data.columns)
+
+def _open(path: str, index: pd.Index, columns: pd.Index, mode: str = 'r'):
+    """
+    以記憶體映射檔為資料的 pd.DataFrame (不讀入記憶體)
+    """
+    return pd.DataFrame(np.load(path, mmap_mode=mode), index=index, columns=columns, copy=False)
+
+def _build(expr: tuple, start: int, stop: int, index: pd.Index, columns: pd.Index, leaves: dict):
+    """
+    以記憶體映射檔的部分欄位重建延遲運算圖 (同一個檔案只讀取一次)
+    """
+    if expr[0] == 'file':
+        if expr[1] not in leaves:
+            arr = np.array(np.load(expr[1], mmap_mode='r')[:, start:stop])
+            rows = expr[2]
+            if rows is not None:
+                arr, index = arr[rows], index[rows]
+            leaves[expr[1]] = LazyQuantDataFrame('leaf', data=pd.DataFrame(arr, index=index, columns=columns[start:stop]))
+        return leaves[expr[1]]
+    args = tuple(_build(arg, start, stop, index, columns, leaves) if isinstance(arg, tuple) and arg[:1] in [('file',), ('node',)] else arg for arg in expr[2])
+    return LazyQuantDataFrame(expr[1], args)
+
+def _fit(result: pd.DataFrame, index: pd.Index):
+    """
+    分塊結果對齊共同的日期 (ex. diff() 移除分塊內整列缺值的日期)，補上的日期為缺值 (布林值為 False)
+    回傳 (陣列, 分塊結果保留的日期)，保留全部日期時為 None
+    """
+    if result.index.equals(index):
+        return np.asarray(result), None
+    rows = index.isin(result.index)
+    result = result.reindex(index, fill_value=False if (result.dtypes == bool).all() else np.nan)
+    return np.asarray(result), rows
+
+def _union(*rows):
+    """
+    各分塊保留日期的聯集 (與直接計算時刪除全部標的皆為缺值的日期相同)，全部保留時為 None
+    """
+    if any(item is None for item in rows):
+        return None
+    rows = np.logical_or.reduce(rows)
+    return None if rows.all() else rows
+
+def _rows(data: pd.DataFrame, rows: np.ndarray):
+    """
+    取出保留的日期 (連續區段時為記憶體映射的切片，不讀入記憶體)
+    """
+    if rows is None:
+        return data
+    position = np.flatnonzero(rows)
+    if len(position) and position[-1] - position[0] + 1 == len(position):
+        return data.iloc[position[0]:position[-1]+1]
+    return data.iloc[position]
+
+def _chunk(task: tuple):
+    """
+    計算一個欄位分塊，寫入輸出檔的對應欄位
+    """
+    expr, start, stop, index, columns, path = task
+    result, rows = _fit(_build(expr, start, stop, index, columns, {}).data, index)
+    out = np.load(path, mmap_mode='r+')
+    out[:, start:stop] = result
+    out.flush()
+    return rows
+
+
+class _TempDir:
+    """
+    預設的暫存目錄: 所有結果都被回收後刪除整個目錄
+    """
+
+    def __init__(self, path: str, count: int):
+        self.path = path
+        self.count = count
+        if count == 0:
+            self.release()
+
+    def release(self):
+        self.count -= 1
+        if self.count <= 0:
+            shutil.rmtree(self.path, ignore_errors=True)
+
+
+class _Executor:
+    """
+    分塊運算的執行狀態: 暫存目錄、共用的日期與標的、已寫入的檔案
+    """
+
+    def __init__(self, path: str, columns: int, n_jobs: int):
+        self.temporary = path is None
+        self.path = path if path is not None else tempfile.mkdtemp(prefix='bbquant-')
+        os.makedirs(self.path, exist_ok=True)
+        self.columns = columns
+        self.n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+        self.index = None
+        self.assets = None
+        self.files = {}
+        ### 各檔案保留的日期 (None 為全部日期)
+        self.rows = {}
+
+    def _file(self):
+        """
+        目錄中不重複的檔名 (同一目錄多次呼叫 chunked() 不會覆寫先前的結果)
+        """
+        handle, file = tempfile.mkstemp(dir=self.path, prefix=f'{os.getpid()}-', suffix='.npy')
+        os.close(handle)
+        return file
+
+    def _check(self, data: pd.DataFrame):
+        if self.index is None:
+            self.index, self.assets = data.index, data.columns
+        assert data.index.equals(self.index) and data.columns.equals(self.assets), 'Chunked evaluation requires inputs with the same index and columns'
+
+    def plan(self, node):
+        """
+        將運算圖轉為可傳遞至子進程的巢狀結構: 已有資料者寫入記憶體映射檔，橫斷面運算先行計算
+        """
+        if not isinstance(node, LazyQuantDataFrame):
+            return node
+        if node.key in self.files:
+            return ('file', self.files[node.key], self.rows.get(self.files[node.key]))
+        if node._data is not None:
+            self._check(node._data)
+            path = self._file()
+            with span('chunked.store', data=node._data):
+                store(node._data, path, self.columns)
+        elif node.op in CROSS:
+            path = self._cross(node)
+        else:
+            return ('node', node.op, tuple(self.plan(arg) for arg in node.args))
+        self.files[node.key] = path
+        return ('file', path, self.rows.get(path))
+
+    def materialize(self, node: LazyQuantDataFrame):
+        """
+        計算節點並寫入記憶體映射檔，回傳檔案路徑
+        """
+        expr = self.plan(node)
+        if expr[0] == 'file':
+            return expr[1]
+
+        path = self._file()
+        bounds = [(start, min(start+self.columns, len(self.assets))) for start in range(0, len(self.assets), self.columns)]
+        with span('chunked.evaluate'):
+            ### 第一個分塊決定輸出型別
+            first, rows = _fit(_build(expr, *bounds[0], self.index, self.assets, {}).data, self.index)
+            out = np.lib.format.open_memmap(path, mode='w+', dtype=first.dtype, shape=(len(self.index), len(self.assets)), fortran_order=True)
+            out[:, slice(*bounds[0])] = first
+            out.flush()
+            del out, first
+
+            tasks = [(expr, start, stop, self.index, self.assets, path) for start, stop in bounds[1:]]
+            if self.n_jobs == 1 or len(tasks) <= 1:
+                rows = _union(rows, *[_chunk(task) for task in tasks])
+            else:
+                with ProcessPoolExecutor(max_workers=min(self.n_jobs, len(tasks))) as pool:
+                    rows = _union(rows, *pool.map(_chunk, tasks))
+        self.files[node.key] = path
+        self.rows[path] = rows
+        return path
+
+    def _cross(self, node: LazyQuantDataFrame):
+        """
+        橫斷面運算: 依列分批讀入整列資料計算
+        """
+        file = self.materialize(node.args[0])
+        source = np.load(file, mmap_mode='r')
+        path = self._file()
+        out = None
+        step = max(1, BLOCK // max(1, len(self.assets)))
+        ### 只計算輸入保留的日期 (ex. diff() 之後)，結果保留相同的日期
+        keep = self.rows[path] = self.rows.get(file)
+        position = np.arange(len(self.index)) if keep is None else np.flatnonzero(keep)
+        with span('chunked.cross', data=source):
+            ### 沒有任何日期時仍以空的分批計算一次，決定輸出型別
+            for start in range(0, len(position) or 1, step):
+                rows = position[start:start+step]
+                block = pd.DataFrame(np.array(source[rows]), index=self.index[rows], columns=self.assets)
+                result = np.asarray(getattr(QuantDataFrame(block), node.op)(*node.args[1:]).data)
+                if out is None:
+                    out = np.lib.format.open_memmap(path, mode='w+', dtype=result.dtype, shape=(len(self.index), len(self.assets)), fortran_order=True)
+                out[rows] = result
+            out.flush()
+        return path
+
+
+def evaluate(*frames, columns: int = 256, path: str = None, n_jobs: int = 1):
+    """
+    以欄位分塊方式計算延遲運算結果，結果以記憶體映射檔保存 (全市場、分鐘資料等記憶體放不下的情況)
+    各標的獨立的運算 (shift、total、average、sustain、逐元素運算等) 每次只讀入一個分塊的欄位，
+    橫斷面運算 (rank、largest、smallest、zscore、percentile、winsorize、neutralize) 依列分批讀入整列
+    columns: 每個分塊的標的數
+    path: 記憶體映射檔的目錄 (結果檔由呼叫者管理)，預設為暫存目錄 (所有結果都被回收後自動刪除)
+    n_jobs: 平行計算分塊的進程數 (-1 為使用全部核心)
+    """
+    executor = _Executor(path, columns, n_jobs)
+    roots = [frame for frame in frames if isinstance(frame, LazyQuantDataFrame) and frame._data is None]
+    outputs = [executor.materialize(root) for root in roots]
+    for root, output in zip(roots, outputs):
+        root._data = _rows(_open(output, executor.index, executor.assets), executor.rows.get(output))
+
+    ### 移除中間結果 (已開啟的映射不受影響)
+    for output in set(executor.files.values()) - set(outputs):
+        os.remove(output)
+
+    ### 預設暫存目錄: 結果都被回收後刪除
+    if executor.temporary:
+        owner = _TempDir(executor.path, len(roots))
+        for root in roots:
+            weakref.finalize(root._data, owner.release)
@@ -3,7 +3,291 @@
 import pandas as pd
 import numpy as np
 import operator
-from IPython.display import display
+import hashlib
+import functools
+from collections import OrderedDict
+from BBQuant import cache
+from BBQuant.profiler import traced
+
+
+### 共用日曆、標的與日曆 / 群組索引的快取筆數上限 (淘汰最久未使用者)
+INDEXES = 64
+
+
+def _digest(values):
+    """
+    內容 (依順序) 的雜湊，作為索引快取的鍵
+    """
+    return hashlib.sha1(pd.util.hash_array(np.asarray(values)).tobytes()).hexdigest()
+
+def _cached(method):
+    """
+    指標快取: 啟用 bbq.use_cache() 時，相同運算鏈與輸入資料直接讀取先前的結果
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        store = cache.current()
+        if store is None:
+            return method(self, *args, **kwargs)
+        ### 原始資料只計算一次指紋 (重新指定 data 時重算)；結果以 (上一層的鍵, 方法, 參數) 為指紋，運算鏈不需重新雜湊資料
+        if self._fingerprint is None:
+            self._fingerprint = cache.fingerprint(self.data)
+        key = store.key(self._fingerprint, method.__name__, args, kwargs)
+        df = store.load(key, self.data)
+        if df is None:
+            result = method(self, *args, **kwargs)
+            store.save(key, result.data)
+        else:
+            result = QuantDataFrame(df)
+        result._fingerprint = key
+        return result
+    return wrapper
+
+def _result(df: pd.DataFrame, *inputs: pd.DataFrame):
+    """
+    運算結果: 浮點數沿用輸入的浮點型別 (ex. float32 的價格資料經過指標、純量運算後仍為 float32，不被提升為 float64)
+    """
+    floats = [dtype for data in inputs for dtype in data.dtypes.unique() if dtype.kind == 'f']
+    if floats and np.result_type(*floats) != np.float64 and all(dtype.kind == 'f' for dtype in df.dtypes.unique()):
+        df = df.astype(np.result_type(*floats), copy=False)
+    return QuantDataFrame(df)
+
+def _nlargest(values: np.ndarray, n: int):
+    """
+    每列取數值最大的前Ｎ筆 (以 argpartition 逐列選取)，回傳布林陣列
+    缺值 (NaN) 不列入；同值時取欄位順序在前者，與 DataFrame.nlargest(keep='first') 相同
+    """
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    select = np.zeros(values.shape, dtype=bool)
+    if n <= 0 or values.size == 0:
+        return select
+    if n >= values.shape[1]:
+        return valid
+
+    temp = np.where(valid, values, -np.inf)
+    kth = -np.partition(-temp, n-1, axis=1)[:, n-1:n]
+    above = valid & (temp > kth)
+    tie = valid & (temp == kth)
+    need = n - above.sum(axis=1, keepdims=True)
+    return above | (tie & (np.cumsum(tie, axis=1) <= need))
+
+def _select(data: pd.DataFrame, n: int, ascending: bool = False, group=None):
+    """
+    largest / smallest 共用: 每列 (或每列的各群組內) 取前Ｎ筆
+    group: 標的 -> 群組的對應 (dict / pd.Series)，未對應到群組的標的不列入
+    """
+    values = np.asarray(data, dtype=float)
+    values = values if not ascending else -values
+    if group is None:
+        select = _nlargest(values, n)
+    else:
+        index = universe.groups(data.columns, group)
+        select = np.zeros(values.shape, dtype=bool)
+        for code in range(index.size):
+            column = np.flatnonzero(index.codes == code)
+            select[:, column] = _nlargest(values[:, column], n)
+    return pd.DataFrame(select, index=data.index, columns=data.columns)
+
+
+class QuantUniverse:
+    """
+    共用的交易日曆與標的清單
+    相同的日期 / 標的只保留一份 Index，同一份資料產生的表即共用日曆與標的，
+    運算元可直接以陣列運算，不需再聯集、重新索引
+    """
+
+    def __init__(self):
+        self.calendars = OrderedDict()
+        self.universes = OrderedDict()
+        self.indexes = OrderedDict()
+
+    def _intern(self, known: OrderedDict, index: pd.Index):
+        """
+        以內容為鍵取出共用的 Index (最多保留 INDEXES 份，淘汰最久未使用者)
+        """
+        key = (str(index.dtype), _digest(index))
+        item = known.get(key)
+        if item is None or not (item is index or item.equals(index)):
+            item = known[key] = index
+            while len(known) > INDEXES:
+                known.popitem(last=False)
+        known.move_to_end(key)
+        return item
+
+    def assign(self, data: pd.DataFrame):
+        """
+        將表的日期、標的對應到共用的日曆與標的
+        """
+        data.index = self._intern(self.calendars, pd.to_datetime(data.index))
+        data.columns = self._intern(self.universes, data.columns)
+        return data
+
+    def _index(self, key: tuple, build):
+        """
+        以內容為鍵的索引快取 (最多保留 INDEXES 筆，淘汰最久未使用者)
+        """
+        cached = self.indexes.get(key)
+        if cached is None:
+            cached = self.indexes[key] = build()
+            while len(self.indexes) > INDEXES:
+                self.indexes.popitem(last=False)
+        self.indexes.move_to_end(key)
+        return cached
+
+    def groups(self, columns: pd.Index, group=None):
+        """
+        標的對應的群組索引 (相同的標的與群組只建立一次；group 為 None 時整列為同一群組)
+        """
+        labels = None if group is None else pd.Series(columns, index=columns).map(group)
+        key = ('groups', _digest(columns), None if labels is None else _digest(labels.values))
+        return self._index(key, lambda: QuantGroups(columns, labels))
+
+    def calendar(self, index: pd.DatetimeIndex):
+        """
+        日期對應的交易日曆索引 (相同的日期只建立一次)
+        """
+        return self._index(('calendar', _digest(index)), lambda: QuantCalendar(index))
+
+
+class QuantGroups:
+    """
+    標的 -> 群組的對應索引: 建立一次，供橫斷面運算以少數幾次陣列運算完成各群組的統計與排序
+    codes: 各欄位的群組代碼 (未對應到群組者為 size)
+    starts: 依群組排列後各群組的起始位置
+    """
+
+    def __init__(self, columns: pd.Index, labels: pd.Series = None):
+        """
+        labels: 各欄位的群組 (未對應到群組者為缺值)，None 為整列同一群組
+        """
+        self.columns = columns
+        if labels is None:
+            codes, self.names = np.zeros(len(columns), dtype=np.int64), pd.Index([None])
+        else:
+            codes, self.names = pd.factorize(labels)
+        self.size = len(self.names)
+        self.codes = np.where(codes >= 0, codes, self.size).astype(np.int16 if self.size < 2**15 else np.int32)
+        self.starts = np.concatenate([[0], np.cumsum(np.bincount(self.codes, minlength=self.size+1))[:-1]])
+
+    def spread(self, stat: np.ndarray):
+        """
+        將 (日期, 群組) 的統計量展開回各欄位 (未對應到群組者為 NaN)
+        """
+        return np.concatenate([stat, np.full((len(stat), 1), np.nan)], axis=1)[:, self.codes]
+
+    def total(self, values: np.ndarray, valid: np.ndarray):
+        """
+        每列各群組有效值的總和 (日期, 群組)，以 (列, 群組代碼) 為鍵只累加有效的儲存格 (inf 不影響其他群組)
+        """
+        key = np.arange(len(values))[:, None] * (self.size+1) + self.codes
+        total = np.bincount(key[valid], weights=values[valid], minlength=len(values) * (self.size+1))
+        return total.reshape(len(values), self.size+1)[:, :self.size]
+
+    def count(self, values: np.ndarray):
+        """
+        每列各群組的有效筆數 (日期, 群組)
+        """
+        valid = ~np.isnan(values)
+        return self.total(valid.astype(float), valid)
+
+    def moments(self, values: np.ndarray):
+        """
+        每列各群組的有效筆數、平均與樣本標準差 (日期, 群組)
+        """
+        valid = ~np.isnan(values)
+        count = self.total(valid.astype(float), valid)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = self.total(values, valid) / count
+            deviation = values - self.spread(mean)
+            std = np.sqrt(self.total(deviation ** 2, valid) / (count - 1))
+        return count, mean, np.where(count > 1, std, np.nan)
+
+    def sort(self, values: np.ndarray, stable: bool = True):
+        """
+        每列依 (群組, 數值由小到大) 排序的欄位位置與其在群組內的名次 (從 0 起算)，缺值排在各群組最後
+        stable: 同值時依欄位順序 (不需要時以較快的不穩定排序)；群組代碼再以穩定排序 (基數排序) 排列
+        """
+        order = np.argsort(values, axis=1, kind='stable' if stable else None)
+        order = np.take_along_axis(order, np.argsort(self.codes[order], axis=1, kind='stable'), axis=1)
+        position = np.arange(values.shape[1]) - self.starts[self.codes[order]]
+        return order, position
+
+    def percentile(self, values: np.ndarray):
+        """
+        每列各群組內的百分位排名 (同值取平均名次，與 DataFrame.rank(pct=True) 相同)
+        """
+        order, position = self.sort(values, stable=False)
+        ordered = np.take_along_axis(values, order, axis=1)
+        codes = self.codes[order]
+        column = np.arange(values.shape[1])
+
+        ### 同值區段: 以區段起點 / 終點的累積取得每個位置所在區段的名次範圍，取平均名次
+        edge = np.ones(values.shape, dtype=bool)
+        edge[:, 1:] = (ordered[:, 1:] != ordered[:, :-1]) | (codes[:, 1:] != codes[:, :-1])
+        close = np.ones(values.shape, dtype=bool)
+        close[:, :-1] = edge[:, 1:]
+        first = np.maximum.accumulate(np.where(edge, column, 0), axis=1)
+        last = np.minimum.accumulate(np.where(close, column, len(column))[:, ::-1], axis=1)[:, ::-1]
+        rank = np.empty(values.shape)
+        np.put_along_axis(rank, order, position + (first + last) / 2 - column + 1, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(np.isnan(values), np.nan, rank / self.spread(self.count(values)))
+
+    def quantile(self, values: np.ndarray, *q: float):
+        """
+        每列各群組的分位數 (線性內插，與 DataFrame.quantile() 相同)，每個分位數回傳一個 (日期, 群組) 陣列
+        """
+        order, _ = self.sort(values, stable=False)
+        ordered = np.take_along_axis(values, order, axis=1)
+        count = self.count(values)
+        top = np.maximum(count - 1, 0)
+        last = values.shape[1] - 1
+        result = []
+        for quantile in q:
+            h = top * quantile
+            lower = np.floor(h)
+            a = np.take_along_axis(ordered, np.minimum(self.starts[:self.size] + lower, last).astype(np.int64), axis=1)
+            b = np.take_along_axis(ordered, np.minimum(self.starts[:self.size] + np.minimum(lower + 1, top), last).astype(np.int64), axis=1)
+            with np.errstate(invalid='ignore'):
+                result.append(np.where(count > 0, a + (h - lower) * (b - a), np.nan))
+        return result
+
+
+class QuantCalendar:
+    """
+    交易日曆索引: 由交易日建立一次，保存各調倉頻率的標籤與整數對應
+    調倉頻率改變時只需以整數位置取值，不需 resample / reindex
+    labels(): 調倉日標籤 (同 resample(freq) 的標籤；也可傳入自訂日期，ex. 月營收公布日)
+    last(): 各標籤當時最後一個交易日的位置 (-1 為尚無資料)
+    bucket(): 各交易日所屬 (最後一個不晚於該日) 標籤的位置 (-1 為尚無標籤)
+    """
+
+    def __init__(self, index: pd.DatetimeIndex):
+        self.index = index
+        self._cache = {}
+
+    def _get(self, kind: str, freq, func):
+        key = (kind, freq if isinstance(freq, str) else tuple(pd.DatetimeIndex(freq).asi8))
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
+
+    def labels(self, freq):
+        def func():
+            if isinstance(freq, str):
+                return pd.Series(0, index=self.index[[0, -1]].unique()).resample(freq).ffill().index
+            return pd.DatetimeIndex(freq).unique().sort_values()
+        return self._get('labels', freq, func)
+
+    def last(self, freq):
+        return self._get('last', freq, lambda: np.searchsorted(self.index.values, self.labels(freq).values, 'right') - 1)
+
+    def bucket(self, freq):
+        return self._get('bucket', freq, lambda: np.searchsorted(self.labels(freq).values, self.index.values, 'right') - 1)
+
+
+universe = QuantUniverse()
 
 
 class QuantDataFrame:
@@ -20,12 +304,48 @@ class QuantDataFrame:
     largest(): 取每列數值中最大的前Ｎ筆 
     smallest(): 取每列數值中最小的前Ｎ筆
     rank(): 取每列數值中最大的前Ｎ等分
+    zscore(): 每列 (或各群組內) 標準化
+    percentile(): 每列 (或各群組內) 的百分位排名
+    winsorize(): 每列 (或各群組內) 將極端值縮至上下分位數
+    neutralize(): 每列 (或各群組內) 減去平均值
     sustain(): 條件持續滿足Ｎ天
     """
     
     def __init__(self, data: pd.DataFrame):
         self.data = data
-        self.data.index = pd.to_datetime(data.index)
+        if not isinstance(data.index, pd.DatetimeIndex):
+            self.data.index = pd.to_datetime(data.index)
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        ### 重新指定資料時，指標快取的指紋隨之失效
+        self._data = value
+        self._fingerprint = None
+
+    def _align(self, other, fill: bool = False):
+        """
+        對齊兩張表，回傳兩者的數值陣列與共同的日期、標的
+        共用 QuantUniverse 的日曆與標的 (或索引相同) 時直接取陣列；
+        否則以聯集日期、交集標的向前填補對齊，不修改原資料
+        fill: 缺值視為 False 並轉為布林值 (邏輯運算)
+        """
+        other = other.data if isinstance(other, QuantDataFrame) else other
+        left = self.data
+        if not ((left.index is other.index or left.index.equals(other.index)) and (left.columns is other.columns or left.columns.equals(other.columns))):
+            union_index = left.index.union(other.index)
+            intersect_col = left.columns.intersection(other.columns)
+            left = left.reindex(index=union_index, columns=intersect_col, method='ffill')
+            other = other.reindex(index=union_index, columns=intersect_col, method='ffill')
+        left_arr = np.asarray(left)
+        other_arr = np.asarray(other)
+        if fill:
+            left_arr = left_arr if left_arr.dtype == bool else np.asarray(left.fillna(False)).astype(bool)
+            other_arr = other_arr if other_arr.dtype == bool else np.asarray(other.fillna(False)).astype(bool)
+        return left_arr, other_arr, left.index, left.columns
 
     def __pos__(self):
         """
@@ -52,15 +372,15 @@ class QuantDataFrame:
         if isinstance(other, (int, float)):
             temp = pd.DataFrame(other, index=self.data.index, columns=self.data.columns)
             df = np.add(self.data, temp)
-            return QuantDataFrame(df)
+            return _result(df, self.data)
 
         if isinstance(other, (pd.DataFrame)):
             df = np.add(self.data, other)
-            return QuantDataFrame(df)
+            return _result(df, self.data, other)
 
         if isinstance(other, (QuantDataFrame)):
             df = np.add(self.data, other.data)
-            return QuantDataFrame(df)
+            return _result(df, self.data, other.data)
     
     def __sub__(self, other):
         """
@@ -69,15 +389,15 @@ class QuantDataFrame:
         if isinstance(other, (int, float)):
             temp = pd.DataFrame(other, index=self.data.index, columns=self.data.columns)
             df = np.subtract(self.data, temp)
-            return QuantDataFrame(df)
+            return _result(df, self.data)
 
         if isinstance(other, (pd.DataFrame)):
             df = np.subtract(self.data, other)
-            return QuantDataFrame(df)
+            return _result(df, self.data, other)
 
         if isinstance(other, (QuantDataFrame)):
             df = np.subtract(self.data, other.data)
-            return QuantDataFrame(df)
+            return _result(df, self.data, other.data)
     
     def __mul__(self, other):
         """
@@ -86,15 +406,15 @@ class QuantDataFrame:
         if isinstance(other, (int, float)):
             temp = pd.DataFrame(other, index=self.data.index, columns=self.data.columns)
             df = np.multiply(self.data, temp)
-            return QuantDataFrame(df)
+            return _result(df, self.data)
 
         if isinstance(other, (pd.DataFrame)):
             df = np.multiply(self.data, other)
-            return QuantDataFrame(df)
+            return _result(df, self.data, other)
 
         if isinstance(other, (QuantDataFrame)):
             df = np.multiply(self.data, other.data)
-            return QuantDataFrame(df)
+            return _result(df, self.data, other.data)
     
     def __truediv__(self, other):
         """
@@ -103,15 +423,15 @@ class QuantDataFrame:
         if isinstance(other, (int, float)):
             temp = pd.DataFrame(other, index=self.data.index, columns=self.data.columns)
             df = np.true_divide(self.data, temp)
-            return QuantDataFrame(df)
+            return _result(df, self.data)
 
         if isinstance(other, (pd.DataFrame)):
             df = np.true_divide(self.data, other)
-            return QuantDataFrame(df)
+            return _result(df, self.data, other)
 
         if isinstance(other, (QuantDataFrame)):
             df = np.true_divide(self.data, other.data)
-            return QuantDataFrame(df)
+            return _result(df, self.data, other.data)
 
     def __gt__(self, other):
         """
@@ -122,21 +442,10 @@ class QuantDataFrame:
             df = operator.__gt__(self.data, temp)
             return QuantDataFrame(df)
 
-        if isinstance(other, (pd.DataFrame)):
-            union_index = self.data.index.union(other.index)
-            intersect_col = self.data.columns.intersection(other.columns)
-            self.data = self.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            other = other.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            df = operator.__gt__(self.data, other)
-            return QuantDataFrame(df)
-
-        if isinstance(other, (QuantDataFrame)):
-            union_index = self.data.index.union(other.data.index)
-            intersect_col = self.data.columns.intersection(other.data.columns)
-            self.data = self.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            other.data = other.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            df = operator.__gt__(self.data, other.data)
-            return QuantDataFrame(df)
+        if isinstance(other, (pd.DataFrame, QuantDataFrame)):
+            left, right, index, columns = self._align(other)
+            df = operator.__gt__(left, right)
+            return QuantDataFrame(pd.DataFrame(df, index=index, columns=columns))
 
     def __lt__(self, other):
         """
@@ -147,22 +456,11 @@ class QuantDataFrame:
             df = operator.__lt__(self.data, temp)
             return QuantDataFrame(df)
 
-        if isinstance(other, (pd.DataFrame)):
-            union_index = self.data.index.union(other.index)
-            intersect_col = self.data.columns.intersection(other.columns)
-            self.data = self.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            other = other.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            df = operator.__lt__(self.data, other)
-            return QuantDataFrame(df)
+        if isinstance(other, (pd.DataFrame, QuantDataFrame)):
+            left, right, index, columns = self._align(other)
+            df = operator.__lt__(left, right)
+            return QuantDataFrame(pd.DataFrame(df, index=index, columns=columns))
 
-        if isinstance(other, (QuantDataFrame)):
-            union_index = self.data.index.union(other.data.index)
-            intersect_col = self.data.columns.intersection(other.data.columns)
-            self.data = self.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            other.data = other.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            df = operator.__lt__(self.data, other.data)
-            return QuantDataFrame(df)
-    
     def __eq__(self, other):
         """
         ex. df == 20
@@ -172,47 +470,26 @@ class QuantDataFrame:
             df = operator.__eq__(self.data, temp)
             return QuantDataFrame(df)
 
-        if isinstance(other, (pd.DataFrame)):
-            union_index = self.data.index.union(other.index)
-            intersect_col = self.data.columns.intersection(other.columns)
-            self.data = self.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            other = other.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            df = operator.__eq__(self.data, other)
-            return QuantDataFrame(df)
+        if isinstance(other, (pd.DataFrame, QuantDataFrame)):
+            left, right, index, columns = self._align(other)
+            df = operator.__eq__(left, right)
+            return QuantDataFrame(pd.DataFrame(df, index=index, columns=columns))
 
-        if isinstance(other, (QuantDataFrame)):
-            union_index = self.data.index.union(other.data.index)
-            intersect_col = self.data.columns.intersection(other.data.columns)
-            self.data = self.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            other.data = other.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            df = operator.__eq__(self.data, other.data)
-            return QuantDataFrame(df)
-    
     def __ne__(self, other):
         """
         ex. df != 20
         """
         if isinstance(other, (int, float)):
             temp = pd.DataFrame(other, index=self.data.index, columns=self.data.columns)
-            df = operator.__ne__(self.data, temp)
+            ### 缺值視為條件不成立 (與其他比較運算元相同)
+            df = operator.__ne__(self.data, temp) & self.data.notna()
             return QuantDataFrame(df)
 
-        if isinstance(other, (pd.DataFrame)):
-            union_index = self.data.index.union(other.index)
-            intersect_col = self.data.columns.intersection(other.columns)
-            self.data = self.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            other = other.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            df = operator.__ne__(self.data, other)
-            return QuantDataFrame(df)
+        if isinstance(other, (pd.DataFrame, QuantDataFrame)):
+            left, right, index, columns = self._align(other)
+            df = operator.__ne__(left, right) & ~pd.isna(left) & ~pd.isna(right)
+            return QuantDataFrame(pd.DataFrame(df, index=index, columns=columns))
 
-        if isinstance(other, (QuantDataFrame)):
-            union_index = self.data.index.union(other.data.index)
-            intersect_col = self.data.columns.intersection(other.data.columns)
-            self.data = self.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            other.data = other.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            df = operator.__ne__(self.data, other.data)
-            return QuantDataFrame(df)
-    
     def __ge__(self, other):
         """
         ex. df >= 20
@@ -222,21 +499,10 @@ class QuantDataFrame:
             df = operator.__ge__(self.data, temp)
             return QuantDataFrame(df)
 
-        if isinstance(other, (pd.DataFrame)):
-            union_index = self.data.index.union(other.index)
-            intersect_col = self.data.columns.intersection(other.columns)
-            self.data = self.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            other = other.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            df = operator.__ge__(self.data, other)
-            return QuantDataFrame(df)
-
-        if isinstance(other, (QuantDataFrame)):
-            union_index = self.data.index.union(other.data.index)
-            intersect_col = self.data.columns.intersection(other.data.columns)
-            self.data = self.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            other.data = other.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            df = operator.__ge__(self.data, other.data)
-            return QuantDataFrame(df)
+        if isinstance(other, (pd.DataFrame, QuantDataFrame)):
+            left, right, index, columns = self._align(other)
+            df = operator.__ge__(left, right)
+            return QuantDataFrame(pd.DataFrame(df, index=index, columns=columns))
 
     def __le__(self, other):
         """
@@ -247,62 +513,30 @@ class QuantDataFrame:
             df = operator.__le__(self.data, temp)
             return QuantDataFrame(df)
 
-        if isinstance(other, (pd.DataFrame)):
-            union_index = self.data.index.union(other.index)
-            intersect_col = self.data.columns.intersection(other.columns)
-            self.data = self.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            other = other.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            df = operator.__le__(self.data, other)
-            return QuantDataFrame(df)
-
-        if isinstance(other, (QuantDataFrame)):
-            union_index = self.data.index.union(other.data.index)
-            intersect_col = self.data.columns.intersection(other.data.columns)
-            self.data = self.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            other.data = other.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            df = operator.__le__(self.data, other.data)
-            return QuantDataFrame(df)
+        if isinstance(other, (pd.DataFrame, QuantDataFrame)):
+            left, right, index, columns = self._align(other)
+            df = operator.__le__(left, right)
+            return QuantDataFrame(pd.DataFrame(df, index=index, columns=columns))
 
     def __and__(self, other):
         """
         對條件取交集 ex. cond1 & cond2
         """
-        if isinstance(other, (pd.DataFrame)):
-            union_index = self.data.index.union(other.index)
-            intersect_col = self.data.columns.intersection(other.columns)
-            self.data = self.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            other = other.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            df = np.logical_and(self.data, other)
-            return QuantDataFrame(df)
-
-        if isinstance(other, (QuantDataFrame)):
-            union_index = self.data.index.union(other.data.index)
-            intersect_col = self.data.columns.intersection(other.data.columns)
-            self.data = self.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            other.data = other.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            df = np.logical_and(self.data, other.data)
-            return QuantDataFrame(df)
+        if isinstance(other, (pd.DataFrame, QuantDataFrame)):
+            left, right, index, columns = self._align(other, fill=True)
+            df = np.logical_and(left, right)
+            return QuantDataFrame(pd.DataFrame(df, index=index, columns=columns))
 
     def __or__(self, other):
         """
         對條件取聯集 ex. cond1 | cond2
         """
-        if isinstance(other, (pd.DataFrame)):
-            union_index = self.data.index.union(other.index)
-            intersect_col = self.data.columns.intersection(other.columns)
-            self.data = self.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            other = other.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            df = np.logical_or(self.data, other)
-            return QuantDataFrame(df)
-
-        if isinstance(other, (QuantDataFrame)):
-            union_index = self.data.index.union(other.data.index)
-            intersect_col = self.data.columns.intersection(other.data.columns)
-            self.data = self.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            other.data = other.data.reindex(index=union_index, columns=intersect_col, method='ffill').fillna(False)
-            df = np.logical_or(self.data, other.data)
-            return QuantDataFrame(df)
+        if isinstance(other, (pd.DataFrame, QuantDataFrame)):
+            left, right, index, columns = self._align(other, fill=True)
+            df = np.logical_or(left, right)
+            return QuantDataFrame(pd.DataFrame(df, index=index, columns=columns))
 
+    @_cached
     def shift(self, n):
         """
         將資料平移Ｎ天
@@ -310,27 +544,31 @@ class QuantDataFrame:
         df = self.data.shift(n)
         return QuantDataFrame(df)
 
+    @_cached
     def total(self, n):
         """
         前Ｎ日總和
         """
         df = self.data.rolling(n).sum()
-        return QuantDataFrame(df)
+        return _result(df, self.data)
 
+    @_cached
     def max(self, n):
         """
         前Ｎ日最大值
         """
         df = self.data.rolling(n).max()
-        return QuantDataFrame(df)
+        return _result(df, self.data)
         
+    @_cached
     def min(self, n):
         """
         前Ｎ日最小值
         """
         df = self.data.rolling(n).min()
-        return QuantDataFrame(df)
+        return _result(df, self.data)
     
+    @_cached
     def diff(self, n):
         """
         今日與前Ｎ日數值的差
@@ -338,13 +576,15 @@ class QuantDataFrame:
         df = (self.data - self.data.shift(n)).dropna(how='all')
         return QuantDataFrame(df)
     
+    @_cached
     def average(self, n):
         """
         前Ｎ日平均值
         """
         df = self.data.rolling(n).mean()
-        return QuantDataFrame(df)
+        return _result(df, self.data)
 
+    @_cached
     def fall(self, n=1):
         """
         今日數值是否比前Ｎ日低
@@ -352,6 +592,7 @@ class QuantDataFrame:
         df = self.data < self.data.shift(n)
         return QuantDataFrame(df)
 
+    @_cached
     def rise(self, n=1):
         """
         今日數值是否比前Ｎ日高
@@ -359,20 +600,25 @@ class QuantDataFrame:
         df = self.data > self.data.shift(n)
         return QuantDataFrame(df)
     
-    def largest(self, n):
+    @_cached
+    def largest(self, n, group=None):
         """
-        取每列數值中最大的前Ｎ筆
+        取每列數值中最大的前Ｎ筆 (缺值不列入，同值時取欄位順序在前者)
+        group: 標的 -> 群組 (ex. 產業) 的對應，給定時取每個群組內最大的前Ｎ筆
         """   
-        df = self.data.astype(float).apply(lambda x: x.nlargest(n), axis=1).reindex_like(self.data).notna()
+        df = _select(self.data, n, ascending=False, group=group)
         return QuantDataFrame(df)
     
-    def smallest(self, n):
+    @_cached
+    def smallest(self, n, group=None):
         """
-        取每列數值中最小的前Ｎ筆
+        取每列數值中最小的前Ｎ筆 (缺值不列入，同值時取欄位順序在前者)
+        group: 標的 -> 群組 (ex. 產業) 的對應，給定時取每個群組內最小的前Ｎ筆
         """
-        df = self.data.astype(float).apply(lambda x: x.nsmallest(n), axis=1).reindex_like(self.data).notna()
+        df = _select(self.data, n, ascending=True, group=group)
         return QuantDataFrame(df)
 
+    @_cached
     def rank(self, n):
         """
         取每列數值中最大的前Ｎ等分 ex. 前50% -> 0.5
@@ -380,6 +626,56 @@ class QuantDataFrame:
         df = self.data.rank(axis=1, ascending=False) <= len(self.data.columns) * n
         return QuantDataFrame(df)
     
+    @_cached
+    def zscore(self, group=None):
+        """
+        每列 (或每列的各群組內) 標準化: (數值 - 平均) / 樣本標準差
+        group: 標的 -> 群組 (ex. 產業) 的對應，未對應到群組的標的為缺值
+        """
+        values = np.asarray(self.data, dtype=float)
+        index = universe.groups(self.data.columns, group)
+        _, mean, std = index.moments(values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df = pd.DataFrame((values - index.spread(mean)) / index.spread(std), index=self.data.index, columns=self.data.columns)
+        return _result(df, self.data)
+
+    @_cached
+    def percentile(self, group=None):
+        """
+        每列 (或每列的各群組內) 的百分位排名，介於 0 ~ 1，數值越大越接近 1 (同值取平均名次)
+        group: 標的 -> 群組 (ex. 產業) 的對應，未對應到群組的標的為缺值
+        """
+        index = universe.groups(self.data.columns, group)
+        df = pd.DataFrame(index.percentile(np.asarray(self.data, dtype=float)), index=self.data.index, columns=self.data.columns)
+        return _result(df, self.data)
+
+    @_cached
+    def winsorize(self, lower=0.01, upper=0.99, group=None):
+        """
+        每列 (或每列的各群組內) 將極端值縮至上下分位數 ex. 1% ~ 99%
+        group: 標的 -> 群組 (ex. 產業) 的對應，未對應到群組的標的為缺值
+        """
+        assert 0 <= lower <= upper <= 1, 'Quantiles should satisfy 0 <= lower <= upper <= 1'
+        values = np.asarray(self.data, dtype=float)
+        index = universe.groups(self.data.columns, group)
+        low, high = (index.spread(bound) for bound in index.quantile(values, lower, upper))
+        df = pd.DataFrame(np.where(np.isnan(values), np.nan, np.clip(values, low, high)), index=self.data.index, columns=self.data.columns)
+        return _result(df, self.data)
+
+    @_cached
+    def neutralize(self, group=None):
+        """
+        每列 (或每列的各群組內) 減去平均值 ex. 產業中性化
+        group: 標的 -> 群組 (ex. 產業) 的對應，未對應到群組的標的為缺值
+        """
+        values = np.asarray(self.data, dtype=float)
+        index = universe.groups(self.data.columns, group)
+        _, mean, _ = index.moments(values)
+        with np.errstate(invalid='ignore'):
+            df = pd.DataFrame(values - index.spread(mean), index=self.data.index, columns=self.data.columns)
+        return _result(df, self.data)
+
+    @_cached
     def sustain(self, n):
         """
         條件持續滿足Ｎ天
@@ -394,9 +690,20 @@ class QuantDataFrame:
         return self.data.head(n) 
         
     def __repr__(self):
+        try:
+            from IPython.display import display
+        except ImportError:
+            return repr(self.data)
         display(self.data)
         return ""
 
     def __str__(self):
         print(self.data)
         return ""
+
+
+### 效能剖析: 運算元與指標方法的計時區段 (未啟用時直接呼叫)
+for _name in ['__pos__', '__neg__', '__invert__', '__add__', '__sub__', '__mul__', '__truediv__', '__gt__', '__lt__', '__eq__', '__ne__', '__ge__', '__le__', '__and__', '__or__',
+              'shift', 'total', 'max', 'min', 'diff', 'average', 'fall', 'rise', 'largest', 'smallest', 'rank',
+              'zscore', 'percentile', 'winsorize', 'neutralize', 'sustain']:
+    setattr(QuantDataFrame, _name, traced('QuantDataFrame.' + _name.strip('_'))(getattr(QuantDataFrame, _name)))
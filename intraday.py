@@ -0,0 +1,183 @@
+''' 多股票量化策略 - 日內 K 棒停利停損 '''
+
+import pandas as pd
+import numpy as np
+from BBQuant.dataframe import universe
+from BBQuant.panel import RENAME
+
+
+def _scan(path: str, fields: list, batch_size: int):
+    """
+    分批讀取 Feather / Arrow 檔案，回傳各批的 (日期時間, 標的, 各欄位) 產生器
+    """
+    import pyarrow as pa
+
+    reader = pa.ipc.open_file(pa.memory_map(path))
+    names = {RENAME.get(name, name): name for name in reader.schema.names}
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        for offset in range(0, batch.num_rows, batch_size):
+            temp = batch.slice(offset, batch_size)
+            yield (pd.to_datetime(temp.column(names['datetime']).to_pandas()), temp.column(names['asset']).to_pandas(),
+                   {field: temp.column(names[field]).to_pandas() for field in fields if field in names})
+
+def _frame(data: pd.DataFrame, fields: list, batch_size: int):
+    """
+    分批取出長格式 pd.DataFrame 的 (日期時間, 標的, 各欄位)
+    """
+    data = data.rename(columns=RENAME)
+    for offset in range(0, len(data), batch_size):
+        temp = data.iloc[offset:offset+batch_size]
+        yield pd.to_datetime(temp.datetime), temp.asset, {field: temp[field] for field in fields if field in temp}
+
+
+class QuantBars:
+    """
+    日內 K 棒資料集: (欄位, 日期, K 棒, 標的) 陣列，K 棒依當日時間對齊，缺漏的 K 棒為 NaN
+    供 intraday 引擎以每根 K 棒的最高 / 最低價觸發停利停損
+    """
+
+    def __init__(self, data: pd.DataFrame, fields: list = None, batch_size: int = 1 << 20, dtype: str = 'float64'):
+        """
+        data: 日內長格式資料 (datetime, asset, open, high, low ...)，或 Feather / Arrow 檔案路徑 (分批讀取兩次)
+        fields: 需要的欄位，至少需要 High、Low，有 Open 時跳空越過價位者以開盤價成交
+        batch_size: 每批的資料筆數
+        dtype: 數值型別 ('float32' 使記憶體減半)
+        """
+        if fields == None:
+            fields = ['Open', 'High', 'Low']
+        assert 'High' in fields and 'Low' in fields, 'Intraday bars need High and Low'
+        batches = (lambda: _scan(data, fields, batch_size)) if isinstance(data, str) else (lambda: _frame(data, fields, batch_size))
+
+        ### 第一次: 日期、當日時間與標的
+        days, times, assets = set(), set(), set()
+        for datetime, asset, _ in batches():
+            day = datetime.dt.normalize()
+            days.update(day.unique())
+            times.update((datetime - day).unique())
+            assets.update(asset.unique())
+        days, times, assets = pd.DatetimeIndex(sorted(days)), pd.TimedeltaIndex(sorted(times)), pd.Index(sorted(assets))
+
+        ### 第二次: 填入陣列
+        self.fields = list(fields)
+        self.values = np.full((len(fields), len(days), len(times), len(assets)), np.nan, dtype=dtype)
+        for datetime, asset, columns in batches():
+            day = datetime.dt.normalize()
+            row, bar, col = days.get_indexer(day), times.get_indexer(datetime - day), assets.get_indexer(asset)
+            for i, field in enumerate(self.fields):
+                if field in columns:
+                    self.values[i, row, bar, col] = pd.to_numeric(columns[field].replace('', np.nan)).values
+
+        temp = universe.assign(pd.DataFrame(index=pd.DatetimeIndex(days, name='datetime'), columns=pd.Index(assets, name='asset')))
+        self.index = temp.index
+        self.columns = temp.columns
+        self.times = times
+
+    def get(self, field: str):
+        """
+        取出單一欄位的 (日期, K 棒, 標的) 陣列 (不複製)
+        """
+        return self.values[self.fields.index(field)]
+
+    def trigger(self, index: pd.Index, columns: pd.Index, fills: list, entry: str = 'open'):
+        """
+        產生 _hold() 使用的停利停損判斷: 持有標的當日任一 K 棒的最高價達停利價或最低價達停損價即出場
+        同一根 K 棒同時達到時視為停損；跳空越過價位時以開盤價成交
+        entry: 'open' 為開盤進場，進場日當天的 K 棒即參與判斷；'close' 為收盤進場，進場日的 K 棒不參與判斷 (皆在進場前)
+        觸發紀錄 (組合, 日期列, K 棒, 欄位, 類型, 成交價) 依序加入 fills
+        """
+        rows = self.index.get_indexer(index)
+        cols = self.columns.get_indexer(columns)
+        high, low = self.get('High'), self.get('Low')
+        open_ = self.get('Open') if 'Open' in self.fields else None
+
+        def trigger(i: int, row: np.ndarray, new: np.ndarray, entry_price: np.ndarray, take_profit: np.ndarray, stop_loss: np.ndarray):
+            stop = np.zeros(row.shape, dtype=bool)
+            if entry == 'close':
+                row = row & ~new
+            pair, asset = np.nonzero(row & (cols >= 0))
+            if rows[i] < 0 or len(asset) == 0:
+                return stop
+
+            ### 只取出持有標的的 K 棒 (K 棒, 持有筆數)
+            source = cols[asset]
+            lower = entry_price[pair, asset] * (1 - stop_loss[pair, 0])
+            upper = entry_price[pair, asset] * (1 + take_profit[pair, 0])
+            hit_low = low[rows[i]][:, source] <= lower
+            hit_high = high[rows[i]][:, source] >= upper
+            hit = hit_low | hit_high
+            found = hit.any(axis=0)
+            bar = hit.argmax(axis=0)[found]
+            pair, asset, source, lower, upper = pair[found], asset[found], source[found], lower[found], upper[found]
+            is_stop = hit_low[bar, np.flatnonzero(found)]
+            first = open_[rows[i], bar, source] if open_ is not None else np.full(len(bar), np.nan)
+            price = np.where(is_stop, np.fmin(first, lower), np.fmax(first, upper))
+
+            stop[pair, asset] = True
+            fills.append((pair, np.full(len(bar), i), bar, asset, np.where(is_stop, 'stop', 'target'), price))
+            return stop
+        return trigger
+
+    def fills(self, fills: list, index: pd.Index, columns: pd.Index, pairs: int = 1):
+        """
+        將觸發紀錄整理為各組合的成交明細 (Asset, Date, Time, Type, Price)
+        """
+        if fills:
+            pair, row, bar, asset, kind, price = (np.concatenate(values) for values in zip(*fills))
+        else:
+            pair = row = bar = asset = np.zeros(0, dtype=int)
+            kind, price = np.zeros(0, dtype=object), np.zeros(0)
+        tables = []
+        for p in range(pairs):
+            mask = pair == p
+            tables.append(pd.DataFrame({
+                'Asset': columns.values[asset[mask]],
+                'Date': index.values[row[mask]],
+                'Time': self.times.values[bar[mask]],
+                'Type': kind[mask],
+                'Price': price[mask]})
+            )
+        return tables
+
+    def __repr__(self):
+        return f'QuantBars(fields={self.fields}, dates={len(self.index)}, bars={len(self.times)}, assets={len(self.columns)})'
+
+
+def _keys(position: pd.DataFrame):
+    """
+    觸發紀錄的出場格子鍵值 (出場列 * 標的數 + 欄位，出場列為觸發日的下一列) 與成交價，依鍵值排序
+    """
+    fills = position.attrs.get('fills')
+    if fills is None or len(fills) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    key = (position.index.get_indexer(fills.Date) + 1) * len(position.columns) + position.columns.get_indexer(fills.Asset)
+    order = np.argsort(key)
+    return key[order], fills.Price.values[order]
+
+def _filled(position: pd.DataFrame, col: np.ndarray, end: np.ndarray):
+    """
+    各持有區間是否由日內觸發出場 (其最後一段報酬與出場成本計入觸發當日)
+    """
+    key, _ = _keys(position)
+    return np.isin(end * len(position.columns) + col, key)
+
+def _override(price, position: pd.DataFrame):
+    """
+    以日內成交價取代出場列的價格: 觸發日的下一列為出場列，其價格改為觸發 K 棒的成交價
+    (_sim() 將該筆報酬與成本計入觸發當日，見 _filled())
+    price: 對齊後價格的取值函式 (_cells)
+    """
+    key, value = _keys(position)
+    if len(key) == 0:
+        return price
+    width = len(position.columns)
+
+    def get(row: np.ndarray, col: np.ndarray, lag: int = 0):
+        out = price(row, col, lag)
+        if lag == 0:
+            target = row * width + col
+            loc = np.minimum(np.searchsorted(key, target), len(key) - 1)
+            match = key[loc] == target
+            out[match] = value[loc[match]]
+        return out
+    return get
@@ -0,0 +1,256 @@
+''' 多股票量化策略 - 延遲運算 '''
+
+import pandas as pd
+import numpy as np
+from BBQuant.dataframe import QuantDataFrame
+from BBQuant.profiler import span
+
+
+### 逐元素運算 (可融合)
+ELEMENTWISE = {
+    'add': np.add,
+    'sub': np.subtract,
+    'mul': np.multiply,
+    'truediv': np.true_divide,
+    'gt': np.greater,
+    'lt': np.less,
+    'eq': np.equal,
+    'ne': lambda a, b: np.not_equal(a, b) & ~pd.isna(a) & ~pd.isna(b),
+    'ge': np.greater_equal,
+    'le': np.less_equal,
+    'and': np.logical_and,
+    'or': np.logical_or,
+    'pos': np.positive,
+    'neg': np.negative,
+    'invert': np.invert,
+}
+
+### 與另一張表進行邏輯運算時，缺值視為 False (同 QuantDataFrame 運算元)
+FILLNA = ['and', 'or']
+
+### 每批融合運算的元素數
+BLOCK = 1 << 16
+
+
+class LazyQuantDataFrame(QuantDataFrame):
+    """
+    延遲運算的 QuantDataFrame: 運算元與方法僅建立運算圖，
+    直到 data 被讀取 (ex. QuantBacktest.strategy()) 才計算
+    """
+
+    def __init__(self, op: str, args: tuple = (), data: pd.DataFrame = None):
+        self.op = op
+        self.args = args
+        if op == 'leaf' and not isinstance(data.index, pd.DatetimeIndex):
+            ### 不修改呼叫者的表
+            data = data.copy(deep=False)
+            data.index = pd.to_datetime(data.index)
+        self._data = data
+        self._fingerprint = None
+        if op == 'leaf':
+            self.key = ('leaf', id(data))
+        else:
+            self.key = (op,) + tuple(arg.key if isinstance(arg, LazyQuantDataFrame) else _const(arg) for arg in args)
+
+    @property
+    def data(self):
+        if self._data is None:
+            evaluate(self)
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+        self._fingerprint = None
+
+    def _unary(self, op):
+        return LazyQuantDataFrame(op, (self,))
+
+    def _binary(self, op, other, scalar: bool = True):
+        if scalar and isinstance(other, (int, float)):
+            return LazyQuantDataFrame(op, (self, other))
+        if isinstance(other, (pd.DataFrame, QuantDataFrame)):
+            return LazyQuantDataFrame(op, (self, leaf(other)))
+
+    __pos__ = lambda self: self._unary('pos')
+    __neg__ = lambda self: self._unary('neg')
+    __invert__ = lambda self: self._unary('invert')
+    __add__ = lambda self, other: self._binary('add', other)
+    __sub__ = lambda self, other: self._binary('sub', other)
+    __mul__ = lambda self, other: self._binary('mul', other)
+    __truediv__ = lambda self, other: self._binary('truediv', other)
+    __gt__ = lambda self, other: self._binary('gt', other)
+    __lt__ = lambda self, other: self._binary('lt', other)
+    __eq__ = lambda self, other: self._binary('eq', other)
+    __ne__ = lambda self, other: self._binary('ne', other)
+    __ge__ = lambda self, other: self._binary('ge', other)
+    __le__ = lambda self, other: self._binary('le', other)
+    __and__ = lambda self, other: self._binary('and', other, scalar=False)
+    __or__ = lambda self, other: self._binary('or', other, scalar=False)
+    __hash__ = object.__hash__
+
+    def shift(self, n):
+        return LazyQuantDataFrame('shift', (self, n))
+
+    def total(self, n):
+        return LazyQuantDataFrame('total', (self, n))
+
+    def max(self, n):
+        return LazyQuantDataFrame('max', (self, n))
+
+    def min(self, n):
+        return LazyQuantDataFrame('min', (self, n))
+
+    def diff(self, n):
+        return LazyQuantDataFrame('diff', (self, n))
+
+    def average(self, n):
+        return LazyQuantDataFrame('average', (self, n))
+
+    def fall(self, n=1):
+        return self < self.shift(n)
+
+    def rise(self, n=1):
+        return self > self.shift(n)
+
+    def largest(self, n, group=None):
+        return LazyQuantDataFrame('largest', (self, n, group))
+
+    def smallest(self, n, group=None):
+        return LazyQuantDataFrame('smallest', (self, n, group))
+
+    def rank(self, n):
+        return LazyQuantDataFrame('rank', (self, n))
+
+    def zscore(self, group=None):
+        return LazyQuantDataFrame('zscore', (self, group))
+
+    def percentile(self, group=None):
+        return LazyQuantDataFrame('percentile', (self, group))
+
+    def winsorize(self, lower=0.01, upper=0.99, group=None):
+        return LazyQuantDataFrame('winsorize', (self, lower, upper, group))
+
+    def neutralize(self, group=None):
+        return LazyQuantDataFrame('neutralize', (self, group))
+
+    def sustain(self, n):
+        return self.total(n) >= n
+
+
+def _const(arg):
+    """
+    常數參數的鍵值 (無法雜湊者如 dict / pd.Series 以物件識別)
+    """
+    try:
+        hash(arg)
+        return ('const', arg)
+    except TypeError:
+        return ('object', id(arg))
+
+def leaf(data):
+    """
+    將 pd.DataFrame / QuantDataFrame 包裝為運算圖的葉節點
+    """
+    if isinstance(data, LazyQuantDataFrame):
+        return data
+    if isinstance(data, QuantDataFrame):
+        data = data.data
+    return LazyQuantDataFrame('leaf', data=data)
+
+def _children(node: LazyQuantDataFrame):
+    return [arg for arg in node.args if isinstance(arg, LazyQuantDataFrame)]
+
+def evaluate(*frames):
+    """
+    計算一個或多個延遲運算結果
+    相同的子運算只計算一次，索引一致的逐元素運算鏈以分批方式融合計算
+    """
+    roots = [frame for frame in frames if isinstance(frame, LazyQuantDataFrame) and frame._data is None]
+
+    ### 各節點被引用次數 (引用多次者需保留結果，作為融合邊界)
+    count = {}
+    stack = list(roots)
+    while stack:
+        node = stack.pop()
+        count[node.key] = count.get(node.key, 0) + 1
+        if count[node.key] == 1 and node._data is None:
+            stack.extend(_children(node))
+
+    memo = {}
+    with span('lazy.evaluate'):
+        for root in roots:
+            root._data = _evaluate(root, memo, count)
+
+def _evaluate(node: LazyQuantDataFrame, memo: dict, count: dict):
+    """
+    計算單一節點 (結果存入 memo，最後一次引用後釋放)
+    """
+    if node._data is not None:
+        return node._data
+    if node.key in memo:
+        result = memo[node.key]
+    elif node.op in ELEMENTWISE:
+        result = _fuse(node, memo, count)
+    else:
+        child = QuantDataFrame(_evaluate(node.args[0], memo, count))
+        result = getattr(child, node.op)(*node.args[1:]).data
+    memo[node.key] = result
+    count[node.key] -= 1
+    if count[node.key] <= 0:
+        del memo[node.key]
+    return result
+
+def _fuse(node: LazyQuantDataFrame, memo: dict, count: dict):
+    """
+    融合計算逐元素運算鏈: 先計算鏈的輸入，再逐批 (BLOCK 個元素) 走完整條運算鏈
+    """
+    inputs = {}
+
+    def collect(item, top):
+        if not isinstance(item, LazyQuantDataFrame):
+            return
+        if item.op in ELEMENTWISE and item._data is None and item.key not in memo and (top or count[item.key] == 1):
+            for arg in item.args:
+                collect(arg, False)
+        elif item.key not in inputs:
+            inputs[item.key] = _evaluate(item, memo, count)
+
+    collect(node, True)
+    frames = list(inputs.values())
+    index, columns = frames[0].index, frames[0].columns
+    if not all(frame.index.equals(index) and frame.columns.equals(columns) for frame in frames):
+        ### 索引不一致時，以 QuantDataFrame 運算元逐一對齊計算
+        def eager(item):
+            if not isinstance(item, LazyQuantDataFrame):
+                return item
+            if item.key in inputs:
+                return QuantDataFrame(inputs[item.key])
+            args = [eager(arg) for arg in item.args]
+            return getattr(args[0], '__'+item.op+'__')(*args[1:])
+
+        return eager(node).data
+
+    arrays = {key: np.asarray(frame) for key, frame in inputs.items()}
+
+    def run(item, rows):
+        if not isinstance(item, LazyQuantDataFrame):
+            return item
+        if item.key in arrays:
+            return arrays[item.key][rows]
+        args = [run(arg, rows) for arg in item.args]
+        if item.op in FILLNA and all(isinstance(arg, LazyQuantDataFrame) for arg in item.args):
+            args = [arg if arg.dtype == bool else np.where(pd.isna(arg), False, arg).astype(bool) for arg in args]
+        return ELEMENTWISE[item.op](*args)
+
+    step = max(1, BLOCK // max(1, len(columns)))
+    result = None
+    for start in range(0, len(index), step):
+        rows = slice(start, start+step)
+        block = run(node, rows)
+        if result is None:
+            result = np.empty((len(index), len(columns)), dtype=block.dtype)
+        result[rows] = block
+    if result is None:
+        result = run(node, slice(0, 0))
+    return pd.DataFrame(result, index=index, columns=columns)
@@ -0,0 +1,245 @@
+''' 多股票量化策略 - 逐日續算回測 '''
+
+import copy
+import pandas as pd
+import numpy as np
+from BBQuant.dataframe import QuantDataFrame
+from BBQuant.report import QuantReport
+
+
+def _recent(data: pd.DataFrame, dates: pd.Index):
+    """
+    只取出新交易日範圍的資料列，並保留前一筆資料供沿用 (不需對齊全部歷史資料)
+    """
+    return data.iloc[max(data.index.searchsorted(dates[0], 'right') - 1, 0):]
+
+def _rows(data: pd.DataFrame, dates: pd.Index, columns: pd.Index, default: bool = None):
+    """
+    取出新交易日的條件列 (沿用前一筆資料，超出資料範圍者為 False)
+    default: 不為 None 時，範圍內一律為此值 (未給出場條件時的出場訊號)
+    """
+    beyond = np.asarray(dates > data.index[-1])
+    if default is not None:
+        rows = np.full((len(dates), len(columns)), default)
+    else:
+        rows = _recent(data, dates).reindex(columns=columns).reindex(dates, method='ffill')
+        rows = np.array(rows.fillna(False).astype(bool))
+    rows[beyond] = False
+    return rows
+
+def _state(entry: pd.DataFrame, exit: pd.DataFrame, columns: pd.Index, date):
+    """
+    截至 date 的原始持有訊號 (最後一次進出場事件為進場者為 True，進場優先於出場)
+    """
+    entry = entry.loc[:date].reindex(columns=columns).fillna(False).astype(bool)
+    if exit is None:
+        exit = pd.DataFrame(True, index=entry.index, columns=columns)
+    else:
+        exit = exit.loc[:date].reindex(columns=columns).fillna(False).astype(bool)
+    index = entry.index.union(exit.index)
+    entry = np.array(entry.reindex(index, fill_value=False))
+    exit = np.array(exit.reindex(index, fill_value=False))
+    event = np.where(entry | exit, np.arange(len(index))[:, None], -1).max(axis=0, initial=-1)
+    return np.where(event >= 0, entry[np.maximum(event, 0), np.arange(len(columns))], False)
+
+
+class QuantLive:
+    """
+    可續算的回測狀態: 保存最後的持有部位、進場價格與停利停損狀態
+    update(): 以新的交易日推進狀態，只計算並附加新的報表列
+    report(): 目前的回測報表 (最後一日全部出場，與 sim() 結果相同)
+    """
+
+    def __init__(self, backtest, entry: QuantDataFrame, exit: QuantDataFrame = None):
+        """
+        backtest: 回測設定 (僅支援每日調倉)
+        entry, exit: 截至目前的進出場條件
+        """
+        from BBQuant.backtest import _hold, _cells
+
+        assert isinstance(backtest.freq, str) and backtest.freq == 'D', 'Incremental update only supports daily rebalancing'
+        assert backtest.engine != 'intraday', 'Incremental update does not support the intraday engine'
+
+        self.backtest = bt = copy.copy(backtest)
+        position, entry_arr, ranking, price_arr, temp = bt._signal(entry, exit, close=False)
+        self.columns = position.columns
+        n, m = position.shape
+
+        ### 多算一列以取得最後一日的實際持有與隔日的停利停損
+        hold = _hold(
+            np.vstack([np.array(position) == 1, np.ones((1, m), dtype=bool)]),
+            np.vstack([entry_arr, np.zeros((1, m), dtype=bool)]),
+            np.vstack([np.array(ranking), np.zeros((1, m))]),
+            np.vstack([price_arr, np.full((1, m), np.nan)]),
+            np.array(temp, dtype=float), bt.nstocks, bt.take_profit, bt.stop_loss)[0]
+        self._stop = ~hold[n]
+        hold = hold[:n]
+
+        price = _cells(bt.trade_price.data, position.index, self.columns)
+        benchmark = bt._benchmark(position.index)
+        real = pd.DataFrame(hold.astype(np.int8), index=position.index, columns=self.columns)
+        close = real.copy()
+        close.iloc[-1] = 0
+        real = bt._sim(real, price, benchmark)
+        close = bt._sim(close, price, benchmark)
+
+        ### 已確定的報表列 (最後一日之前)
+        date = position.index[-1]
+        self.payoff_table = close.payoff_table.iloc[:-1]
+        self._cumsum = self.payoff_table.cumsum()
+        self.trade_table = close.trade_table[close.trade_table['Exit Date'] < date]
+        self.hold_table = close.hold_table.iloc[:-1]
+
+        ### 最後一日: 實際狀態與全部出場兩種版本
+        self._last = {
+            'real': (real.payoff_table.iloc[-1:], real.trade_table[real.trade_table['Exit Date'] == date], real.hold_table.iloc[-1:]),
+            'close': (close.payoff_table.iloc[-1:], close.trade_table[close.trade_table['Exit Date'] == date], close.hold_table.iloc[-1:]),
+        }
+
+        ### 逐日狀態
+        start = np.zeros_like(hold)
+        start[0] = hold[0]
+        start[1:] = hold[1:] & ~hold[:-1]
+        start_row = np.where(start, np.arange(n)[:, None], -1).max(axis=0)
+        self.date = date
+        self._hold = hold[-1]
+        self._entry = start[-1] if n > 1 else np.zeros(m, dtype=bool)
+        self._entry_price = np.where(start_row >= 0, price_arr[np.maximum(start_row, 0), np.arange(m)], np.nan)
+        self._entry_date = position.index.values[np.maximum(start_row, 0)]
+        self._price = price_arr[-1]
+        self._signal = np.array(position.iloc[-1]) == 1
+        self._raw = _state(entry.data, exit.data if exit is not None else None, self.columns, date)
+
+        raw = bt._ranks(position.index, self.columns)[0]
+        self._rank = raw[-1]
+        self._range = [np.nanmin(np.append(raw.ravel(), np.inf)), np.nanmax(np.append(raw.ravel(), -np.inf))]
+
+        taiex = bt._close(position.index)
+        self._close = (taiex.iloc[0], taiex.iloc[-1])
+
+    def update(self, entry: QuantDataFrame, exit: QuantDataFrame = None, trade_price: QuantDataFrame = None, rank: QuantDataFrame = None):
+        """
+        以新的交易日推進回測 (進場價格中晚於目前狀態的交易日)
+        entry, exit: 涵蓋新交易日的進出場條件
+        trade_price, rank: 更新後的進出場價格與排名，預設沿用原設定
+        """
+        from BBQuant.backtest import _top
+        from BBQuant.lazy import evaluate
+
+        bt = self.backtest
+        evaluate(entry, exit, trade_price, rank)
+        if trade_price is not None:
+            bt.trade_price = trade_price
+        if rank is not None:
+            bt.rank = rank
+
+        price = bt.trade_price.data
+        dates = price.index[price.index > self.date]
+        if len(dates) == 0:
+            return self
+
+        prices = np.array(price.loc[dates].reindex(columns=self.columns), dtype=float)
+        entries = _rows(entry.data, dates, self.columns)
+        exits = _rows(entry.data, dates, self.columns, True) if exit == None else _rows(exit.data, dates, self.columns)
+        ranks = np.array(_recent(bt.rank.data, dates).reindex(columns=self.columns).astype(float).reindex(dates, method='ffill'))
+        fee, tax = bt.fee, bt.tax
+        tp, sl = bt.take_profit, bt.stop_loss
+
+        payoffs, trades, holds = [], [], []
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i, date in enumerate(dates):
+                ### 持有訊號 (前一日的原始訊號)
+                signal = self._raw
+                self._raw = np.where(entries[i], True, np.where(exits[i], False, self._raw))
+                entry_now = signal & ~self._signal
+
+                ### 持有上限、停利停損
+                row = signal & ~self._stop & (self._hold | entry_now)
+                if row.sum() > bt.nstocks:
+                    now = int(row.sum() - entry_now.sum())
+                    lo, hi = self._range
+                    ranking = np.nan_to_num((self._rank - lo) / (hi - lo), nan=0)
+                    row &= _top(ranking, entry_now, bt.nstocks-now) | ~entry_now
+                new = entry_now & row
+                self._entry_price[new] = prices[i][new]
+                self._entry_date[new] = np.datetime64(date, 'ns')
+                ratio = np.where(row, prices[i] / self._entry_price, np.nan)
+                self._stop = (ratio > 1 + tp) | (ratio < 1 - sl)
+
+                ### 當日報酬與出場交易 (全部出場版本僅最後一日需要)
+                count = self._hold.sum()
+                weight = self._hold / count if count else np.zeros(len(self.columns))
+                gross = (prices[i] - self._price) / self._entry_price
+                gross -= fee * self._entry
+                versions = {'real': self._hold & ~row}
+                if i == len(dates) - 1:
+                    versions['close'] = self._hold
+                for version, exit_now in versions.items():
+                    col = np.flatnonzero(exit_now)
+                    payoffs.append((version, (gross - (fee + tax) * exit_now) * weight))
+                    trades.append((version, pd.DataFrame({
+                        'Asset': self.columns.values[col],
+                        'Entry Date': self._entry_date[col],
+                        'Exit Date': np.full(len(col), np.datetime64(date, 'ns')),
+                        'Entry Price': self._entry_price[col],
+                        'Exit Price': prices[i][col],
+                        'Weight': weight[col],
+                        'Return': (prices[i][col] / self._entry_price[col] - 1 - 2 * fee - tax) * weight[col]})
+                    ))
+                    holds.append((version, int(row.sum()) if version == 'real' else 0))
+
+                self._entry = row & ~self._hold
+                self._hold = row
+                self._signal = signal
+                self._price = prices[i]
+                self._rank = ranks[i]
+                self._range = [np.nanmin([self._range[0], np.nanmin(np.append(ranks[i], np.inf))]), np.nanmax([self._range[1], np.nanmax(np.append(ranks[i], -np.inf))])]
+
+        ### 基準指數
+        taiex = bt._close(dates.insert(0, self.date))
+        taiex.iloc[0] = self._close[1]
+        benchmark = ((taiex - taiex.shift(1)) / self._close[0]).fillna(0).values[1:]
+        self._close = (self._close[0], taiex.iloc[-1])
+
+        ### 新增的報表列
+        real = [value for version, value in payoffs if version == 'real']
+        table = pd.DataFrame()
+        table['Strategy'] = pd.DataFrame(np.array(real), index=dates).fillna(0).sum(axis=1)
+        table['Benchmark'] = benchmark
+        close = pd.DataFrame()
+        close['Strategy'] = pd.DataFrame(np.array([payoffs[-1][1]]), index=dates[-1:]).fillna(0).sum(axis=1)
+        close['Benchmark'] = benchmark[-1:]
+        hold = pd.Series([value for version, value in holds if version == 'real'], index=dates)
+        trade = [value for version, value in trades if version == 'real']
+
+        ### 確定先前的最後一日與新增的前幾日，保留新的最後一日
+        last_payoff, last_trade, last_hold = self._last['real']
+        payoff = pd.concat([last_payoff, table.iloc[:-1]])
+        if len(self._cumsum):
+            payoff_cumsum = pd.concat([self._cumsum.iloc[-1:], payoff]).cumsum().iloc[1:]
+        else:
+            payoff_cumsum = payoff.cumsum()
+        self._cumsum = pd.concat([self._cumsum, payoff_cumsum])
+        self.payoff_table = pd.concat([self.payoff_table, payoff])
+        self.trade_table = pd.concat([self.trade_table, last_trade] + trade[:-1], ignore_index=True)
+        self.hold_table = pd.concat([self.hold_table, last_hold, hold.iloc[:-1]])
+        self._last = {
+            'real': (table.iloc[-1:], trade[-1], hold.iloc[-1:]),
+            'close': (close, trades[-1][1], pd.Series([0], index=dates[-1:])),
+        }
+        self.date = dates[-1]
+        return self
+
+    def report(self):
+        """
+        目前的回測報表 (最後一日全部出場)
+        """
+        last_payoff, last_trade, last_hold = self._last['close']
+        payoff_table = pd.concat([self.payoff_table, last_payoff])
+        if len(self._cumsum):
+            cumsum = pd.concat([self._cumsum, pd.concat([self._cumsum.iloc[-1:], last_payoff]).cumsum().iloc[1:]])
+        else:
+            cumsum = last_payoff.cumsum()
+        trade_table = pd.concat([self.trade_table, last_trade], ignore_index=True)
+        hold_table = pd.concat([self.hold_table, last_hold])
+        return QuantReport(payoff_table, cumsum + 1, trade_table, hold_table, self.backtest.rf)
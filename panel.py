@@ -0,0 +1,164 @@
+''' 多股票量化策略 - 多欄位資料集 '''
+
+import pandas as pd
+import numpy as np
+from BBQuant.dataframe import QuantDataFrame, universe
+
+
+### 欄位名稱
+RENAME = {'open': 'Open', 'high': 'High', 'low': 'Low', 'close': 'Close', 'volume': 'Volume'}
+
+### 日內資料彙總為日資料的方式 (其餘欄位取最後一筆)
+AGG = {'Open': 'first', 'High': 'max', 'Low': 'min', 'Close': 'last', 'Volume': 'sum'}
+
+
+def _records(batch: pd.DataFrame, fields: list):
+    """
+    將一批原始資料轉為彙總紀錄 (first / last 欄位另記錄取值時間)
+    """
+    datetime = pd.to_datetime(batch.datetime)
+    records = pd.DataFrame({'date': datetime.dt.normalize(), 'asset': batch.asset})
+    for field in fields:
+        records[field] = batch[field].replace('', np.nan).astype(float)
+        if AGG.get(field, 'last') in ['first', 'last']:
+            records[field+' time'] = datetime
+    return records
+
+def _reduce(records: pd.DataFrame, fields: list):
+    """
+    將彙總紀錄合併為每個日期、標的一筆 (可重複套用於多批的部分結果)
+    first / last 依取值時間取最早 / 最晚的非缺值，max / min / sum 直接合併
+    """
+    keys = [records.date, records.asset]
+    result = {}
+    for field in fields:
+        agg = AGG.get(field, 'last')
+        if agg in ['first', 'last']:
+            temp = records[records[field].notna()].sort_values(field+' time', kind='mergesort')
+            group = temp.groupby([temp.date, temp.asset])
+            result[field] = group[field].agg(agg)
+            result[field+' time'] = group[field+' time'].agg(agg)
+        else:
+            result[field] = records.groupby(keys)[field].agg(agg)
+    return pd.DataFrame(result).rename_axis(['date', 'asset']).reset_index()
+
+def _stream(path: str, fields: list = None, batch_size: int = 65536):
+    """
+    分批讀取 Feather / Arrow 檔案並逐批彙總為日資料，記憶體用量取決於批次大小與結果大小
+    """
+    import pyarrow as pa
+
+    reader = pa.ipc.open_file(pa.memory_map(path))
+    names = {RENAME.get(name, name): name for name in reader.schema.names}
+    if fields == None:
+        fields = [field for field in names if field not in ['datetime', 'asset']]
+    columns = ['datetime', 'asset'] + [names[field] for field in fields]
+
+    ### 各批的部分結果以二元合併樹合併 (每筆紀錄只被合併 log(批數) 次)；
+    ### 依時間排序的輸入中，早於本批第一天的日期不會再出現，直接移出合併樹
+    done, stack = [], []
+    ordered, last = True, None
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i).select(columns)
+        for offset in range(0, batch.num_rows, batch_size):
+            temp = batch.slice(offset, batch_size).to_pandas().rename(columns=RENAME)
+            temp['datetime'] = datetime = pd.to_datetime(temp.datetime)
+            ordered = ordered and (last is None or datetime.min() >= last)
+            last = datetime.max() if last is None else max(last, datetime.max())
+            if ordered:
+                cut = datetime.min().normalize()
+                finished = [frame for frame in (frame[frame.date < cut] for _, frame in stack) if len(frame)]
+                if finished:
+                    done.append(finished[0] if len(finished) == 1 else _reduce(pd.concat(finished, ignore_index=True), fields))
+                    stack = [(level, frame[frame.date >= cut]) for level, frame in stack]
+
+            stack.append((0, _reduce(_records(temp, fields), fields)))
+            while len(stack) > 1 and stack[-1][0] == stack[-2][0]:
+                (level, new), (_, old) = stack.pop(), stack.pop()
+                stack.append((level + 1, _reduce(pd.concat([old, new], ignore_index=True), fields)))
+    ### 輸入未依時間排序時，已移出的日期可能再出現，需與其餘部分結果一起合併
+    frames = [frame for _, frame in stack]
+    if ordered:
+        state = pd.concat(done + [_reduce(pd.concat(frames, ignore_index=True), fields)], ignore_index=True)
+    else:
+        state = _reduce(pd.concat(done + frames, ignore_index=True), fields)
+    return state[fields], state.date, state.asset, fields
+
+def _aggregate(frame: pd.DataFrame, datetime: pd.Series, asset: pd.Series, fields: list):
+    """
+    依時間先後 (同時間者依資料順序) 一次 groupby 彙總所有欄位為每個日期、標的一筆，與串流讀取相同
+    """
+    if not datetime.is_monotonic_increasing:
+        order = np.argsort(datetime.values, kind='stable')
+        frame, datetime, asset = frame.iloc[order], datetime.iloc[order], asset.iloc[order]
+    frame = frame.groupby([datetime.dt.normalize().values, asset.values]).agg({field: AGG.get(field, 'last') for field in fields})
+    return frame, frame.index.get_level_values(0), frame.index.get_level_values(1)
+
+def _ffill(values: np.ndarray):
+    """
+    沿日期 (第一維) 向前填補缺值
+    """
+    valid = ~np.isnan(values)
+    index = np.where(valid, np.arange(values.shape[0])[:, None], 0)
+    np.maximum.accumulate(index, axis=0, out=index)
+    return np.take_along_axis(values, index, axis=0)
+
+
+class QuantPanel:
+    """
+    多欄位資料集: 一次讀入長格式資料，產生 (欄位, 日期, 標的) 陣列
+    get(): 取出單一欄位的 QuantDataFrame (不複製)
+    """
+
+    def __init__(self, data: pd.DataFrame, fields: list = None, batch_size: int = 65536, dtype: str = 'float64'):
+        """
+        data: 長格式資料 (datetime, asset, 各欄位)，或 Feather / Arrow 檔案路徑 (分批串流彙總)
+        fields: 需要的欄位，預設 datetime 與 asset 以外的全部欄位
+        batch_size: 串流讀取時每批的資料筆數
+        dtype: 數值型別 ('float32' 使記憶體減半)
+        """
+        if isinstance(data, str):
+            frame, datetime, asset, fields = _stream(data, fields, batch_size)
+        else:
+            data = data.rename(columns=RENAME)
+            datetime = pd.to_datetime(data.datetime)
+            if fields == None:
+                fields = [column for column in data.columns if column not in ['datetime', 'asset']]
+            frame = pd.DataFrame({field: data[field].replace('', np.nan).astype(float) for field in fields})
+
+            ### 日內資料: 一次 groupby 彙總所有欄位
+            if datetime.iloc[0].hour != 0:
+                frame, datetime, asset = _aggregate(frame, datetime, data.asset, fields)
+            else:
+                asset = data.asset
+
+        row, dates = pd.factorize(np.asarray(datetime), sort=True)
+        col, assets = pd.factorize(np.asarray(asset), sort=True)
+
+        ### 日資料中重複的 (日期, 標的): 與日內資料相同地彙總
+        if len(row) and np.bincount(row * len(assets) + col).max() > 1:
+            frame, datetime, asset = _aggregate(frame, pd.Series(np.asarray(datetime)), pd.Series(np.asarray(asset)), fields)
+            row, dates = pd.factorize(np.asarray(datetime), sort=True)
+            col, assets = pd.factorize(np.asarray(asset), sort=True)
+        self.fields = list(fields)
+        self.values = np.full((len(fields), len(dates), len(assets)), np.nan, dtype=dtype)
+        for i, field in enumerate(fields):
+            self.values[i, row, col] = frame[field].values
+            self.values[i] = _ffill(self.values[i])
+
+        temp = universe.assign(pd.DataFrame(index=pd.DatetimeIndex(dates, name='datetime'), columns=pd.Index(assets, name='asset')))
+        self.index = temp.index
+        self.columns = temp.columns
+
+    def get(self, column: str):
+        """
+        取出單一欄位 (Index: 時間, Columns: 標的)，與原陣列共用記憶體
+        """
+        df = pd.DataFrame(self.values[self.fields.index(column)], index=self.index, columns=self.columns, copy=False)
+        return QuantDataFrame(df)
+
+    def __getitem__(self, column: str):
+        return self.get(column)
+
+    def __repr__(self):
+        return f'QuantPanel(fields={self.fields}, dates={len(self.index)}, assets={len(self.columns)})'
@@ -0,0 +1,132 @@
+''' 多股票量化策略 - 多進程回測 '''
+
+import os
+import copy
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
+from BBQuant.dataframe import QuantDataFrame
+
+
+_worker = {}
+
+
+def share(arr: np.ndarray):
+    """
+    將陣列發佈至共享記憶體，回傳共享記憶體與其描述 (名稱, 形狀, 型別)
+    """
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+def attach(spec: tuple):
+    """
+    依描述連結共享記憶體，回傳共享記憶體與陣列 (不複製)
+    """
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+def publish(backtest):
+    """
+    將進出場價格、排名、基準指數與日內 K 棒發佈至共享記憶體 (基準指數只在主進程讀取一次)
+    """
+    handles = []
+    state = {key: value for key, value in backtest.__dict__.items() if key not in ['trade_price', 'rank', 'benchmark', '_taiex', '_aligned', 'bars']}
+
+    def frame(data: pd.DataFrame):
+        ### 保留原本的浮點型別 (ex. float32)，其餘型別轉為 float64
+        arr = np.asarray(data)
+        shm, spec = share(arr if arr.dtype.kind == 'f' else arr.astype(float))
+        handles.append(shm)
+        return spec, data.index, data.columns
+
+    state['trade_price'] = frame(backtest.trade_price.data)
+    state['rank'] = frame(backtest.rank.data) if backtest.rank is not None else None
+    taiex = backtest._load_benchmark()
+    state['_taiex'] = frame(taiex) if taiex is not None else None
+    state['benchmark'] = None
+    state['_aligned'] = None
+
+    ### 日內 K 棒 (intraday 引擎)
+    state['bars'] = None
+    if getattr(backtest, 'bars', None) is not None:
+        shm, spec = share(backtest.bars.values)
+        handles.append(shm)
+        state['bars'] = (spec, {key: value for key, value in backtest.bars.__dict__.items() if key != 'values'})
+    return handles, state
+
+def _init(state: dict):
+    """
+    子進程初始化: 由共享記憶體重建回測設定
+    """
+    from BBQuant.backtest import QuantBacktest
+    from BBQuant.intraday import QuantBars
+
+    def frame(spec):
+        shm, arr = attach(spec[0])
+        _worker.setdefault('handles', []).append(shm)
+        return pd.DataFrame(arr, index=spec[1], columns=spec[2], copy=False)
+
+    state = dict(state)
+    backtest = QuantBacktest.__new__(QuantBacktest)
+    backtest.__dict__.update(state)
+    backtest.trade_price = QuantDataFrame(frame(state['trade_price']))
+    backtest.rank = QuantDataFrame(frame(state['rank'])) if state['rank'] is not None else None
+    backtest._taiex = frame(state['_taiex']) if state['_taiex'] is not None else None
+    if state['bars'] is not None:
+        shm, values = attach(state['bars'][0])
+        _worker.setdefault('handles', []).append(shm)
+        backtest.bars = QuantBars.__new__(QuantBars)
+        backtest.bars.__dict__.update(state['bars'][1], values=values)
+    _worker['backtest'] = backtest
+
+def _work(task: tuple):
+    return evaluate(_worker['backtest'], *task)
+
+def evaluate(backtest, setting: dict, entry: QuantDataFrame, exit: QuantDataFrame = None, pairs: list = None, report: bool = False, limits: list = None):
+    """
+    以指定設定回測單一候選策略 (pairs 不為 None 時批次評估停利/停損組合)
+    limits: 持有檔數上限的候選值，共用同一份排名順序索引 (依上限、組合的順序回傳)
+    回傳 [(回測數據, 淨值走勢)]，report 為 True 時回傳 [QuantReport]
+    """
+    backtest = copy.copy(backtest)
+    backtest.__dict__.update(setting)
+    if report:
+        return [backtest.sim(backtest.strategy(entry, exit))]
+    if pairs is None and limits is None:
+        report = backtest.sim(backtest.strategy(entry, exit))
+        return [(report.stats(), report.equity_table.Strategy)]
+    reports = list(backtest._sweep(entry, exit, pairs, limits=limits).values())
+    stats = backtest._stats(reports)
+    return [(stats.iloc[i], report.equity_table.Strategy) for i, report in enumerate(reports)]
+
+def workers(n_jobs: int):
+    """
+    檢查並換算進程數 (-1 為使用全部核心)
+    """
+    assert n_jobs == -1 or n_jobs >= 1, 'n_jobs should be -1 or a positive integer'
+    return os.cpu_count() if n_jobs == -1 else n_jobs
+
+def run(backtest, tasks: list, n_jobs: int = 1):
+    """
+    執行多個候選策略，n_jobs > 1 時分派至多進程 (-1 為使用全部核心)
+    tasks: [(設定, 進場條件, 出場條件, 停利停損組合, 是否回傳報表, 持有檔數上限)]
+    """
+    n_jobs = workers(n_jobs)
+
+    ### 基準指數在複製設定前讀取一次 (各候選策略的複本共用)
+    backtest._load_benchmark()
+    if n_jobs == 1 or len(tasks) <= 1:
+        return [evaluate(backtest, *task) for task in tasks]
+
+    handles, state = publish(backtest)
+    try:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, len(tasks)), initializer=_init, initargs=(state,)) as pool:
+            return list(pool.map(_work, tasks))
+    finally:
+        for shm in handles:
+            shm.close()
+            shm.unlink()
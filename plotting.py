@@ -0,0 +1,24 @@
+''' 多股票量化策略 - 繪圖設定 '''
+
+import platform
+
+
+_plt = None
+
+
+def pyplot():
+    """
+    第一次繪圖時才載入 matplotlib 並設定中文字型，計算流程不需要任何繪圖套件
+    """
+    global _plt
+    if _plt is None:
+        import matplotlib.pyplot as plt
+
+        if platform.system() == "Windows":
+            plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei']
+            plt.rcParams['axes.unicode_minus'] = False
+        elif platform.system() == "Darwin":
+            plt.rcParams['font.sans-serif'] = ['SimHei']
+            plt.rcParams['axes.unicode_minus'] = False
+        _plt = plt
+    return _plt
@@ -0,0 +1,191 @@
+''' 多股票量化策略 - 效能剖析 '''
+
+import os
+import json
+import time
+import functools
+import threading
+import tracemalloc
+import pandas as pd
+import numpy as np
+
+
+_active = None
+
+
+class _Null:
+    """
+    未啟用剖析時的區段 (不做任何事)
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def shape(self, **arrays):
+        pass
+
+
+_null = _Null()
+
+
+class _Span:
+    """
+    單一計時區段: 記錄經過時間、配置記憶體與陣列形狀
+    """
+
+    def __init__(self, profiler, name: str, arrays: dict):
+        self.profiler = profiler
+        self.name = name
+        self.shapes = {}
+        self.shape(**arrays)
+
+    def shape(self, **arrays):
+        """
+        記錄陣列 (np.ndarray / pd.DataFrame / QuantDataFrame) 的形狀
+        """
+        for key, arr in arrays.items():
+            if not isinstance(arr, (np.ndarray, pd.DataFrame, pd.Series)) and hasattr(arr, '__dict__'):
+                ### QuantDataFrame 取其資料 (延遲運算尚未計算者不觸發計算)
+                arr = vars(arr).get('_data', vars(arr).get('data'))
+            if hasattr(arr, 'shape'):
+                self.shapes[key] = list(arr.shape)
+
+    def __enter__(self):
+        self.depth = len(self.profiler._stack)
+        if self.profiler.memory:
+            ### 重設峰值前，先將目前峰值併入外層區段
+            if self.profiler._stack:
+                parent = self.profiler._stack[-1]
+                parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+            self.memory = tracemalloc.get_traced_memory()[0]
+            self.peak = self.memory
+            tracemalloc.reset_peak()
+        self.profiler._stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        record = {'name': self.name, 'start': self.start - self.profiler.origin, 'seconds': end - self.start, 'depth': self.depth}
+        self.profiler._stack.pop()
+        if self.profiler.memory:
+            ### 內層區段會重設峰值，取自身與內層峰值的最大者，並回報給外層
+            current, peak = tracemalloc.get_traced_memory()
+            self.peak = max(self.peak, peak)
+            record['bytes'] = current - self.memory
+            record['peak_bytes'] = self.peak - self.memory
+            if self.profiler._stack:
+                parent = self.profiler._stack[-1]
+                parent.peak = max(parent.peak, self.peak)
+        if self.shapes:
+            record['shapes'] = self.shapes
+        self.profiler.spans.append(record)
+        return False
+
+
+class QuantProfiler:
+    """
+    效能剖析: 在 with 區塊中收集 strategy()、sim() 各階段與 QuantDataFrame 運算的計時區段
+    summary(): 依區段名稱彙整
+    to_json(): 以 JSON 輸出全部區段
+    to_chrome(): 以 Chrome trace 格式輸出 (chrome://tracing、Perfetto)
+    """
+
+    def __init__(self, memory: bool = False):
+        """
+        memory: 以 tracemalloc 記錄每個區段配置的記憶體 (會使程式變慢)
+        """
+        self.memory = memory
+        self.spans = []
+        self._stack = []
+        self._previous = None
+
+    def __enter__(self):
+        global _active
+        self._previous = _active
+        self.origin = time.perf_counter()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        else:
+            self._tracing = False
+        _active = self
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = self._previous
+        if self._tracing:
+            tracemalloc.stop()
+        return False
+
+    def summary(self):
+        """
+        各區段的次數、總時間與平均時間 (依總時間排序)
+        """
+        df = pd.DataFrame(self.spans, columns=['name', 'seconds'] + (['bytes', 'peak_bytes'] if self.memory else []))
+        agg = {'seconds': ['count', 'sum', 'mean']}
+        if self.memory:
+            agg['peak_bytes'] = 'max'
+        df = df.groupby('name').agg(agg)
+        df.columns = ['Calls', 'Total [s]', 'Mean [s]'] + (['Peak [bytes]'] if self.memory else [])
+        return df.sort_values('Total [s]', ascending=False)
+
+    def to_json(self, path: str = None):
+        """
+        全部區段 (依開始時間排序)，path 不為 None 時寫入檔案
+        """
+        text = json.dumps(sorted(self.spans, key=lambda span: span['start']), indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+    def to_chrome(self, path: str = None):
+        """
+        Chrome trace 格式 (complete events，時間單位為微秒)，path 不為 None 時寫入檔案
+        """
+        events = []
+        for span in self.spans:
+            args = {key: span[key] for key in ['bytes', 'peak_bytes', 'shapes'] if key in span}
+            events.append({'name': span['name'], 'ph': 'X', 'ts': span['start'] * 1e6, 'dur': span['seconds'] * 1e6, 'pid': os.getpid(), 'tid': threading.get_ident(), 'args': args})
+        text = json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'})
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(text)
+        return text
+
+
+def span(name: str, **arrays):
+    """
+    計時區段 (未啟用剖析時幾乎沒有額外成本)
+    ex. with span('sim.ledger', price=price_arr): ...
+    """
+    if _active is None:
+        return _null
+    return _Span(_active, name, arrays)
+
+def traced(name: str):
+    """
+    將函式包裝為計時區段，並記錄第一個參數與回傳值的形狀
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            with _Span(_active, name, {'input': args[0]} if args else {}) as record:
+                result = func(*args, **kwargs)
+                record.shape(output=result)
+            return result
+        return wrapper
+    return decorator
+
+def profile(memory: bool = False):
+    """
+    建立效能剖析器，於 with 區塊中啟用
+    """
+    return QuantProfiler(memory)
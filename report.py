@@ -2,44 +2,204 @@
 
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import plotly.express as px
-import plotly.graph_objects as go
-import platform
+from BBQuant.plotting import pyplot
+from BBQuant.profiler import traced
 
 
-if platform.system() == "Windows":
-    plt.rcParams['font.sans-serif'] = ['Microsoft JhengHei']
-    plt.rcParams['axes.unicode_minus'] = False
-elif platform.system() == "Darwin":
-    plt.rcParams['font.sans-serif'] = ['SimHei']
-    plt.rcParams['axes.unicode_minus'] = False
+### 回測數據欄位 (與 QuantReport.stats() 相同)
+STATS = [
+    'Start Date',
+    'End Date',
+    'Period [days]',
+    'Win Period [days]',
+    'Total Return [%]',
+    'Total Benchmark Return [%]',
+    'Return [%]',
+    'Benchmark Return [%]',
+    'Volatility [%]',
+    'MDD [%]',
+    'MDD Duration [days]',
+    'Total Trades',
+    'Win Rate [%]',
+    'Best Trade [%]',
+    'Worst Trade [%]',
+    'Average Trade [%]',
+    'Profit Factor',
+    'Win Loss Ratio',
+    'Sharpe Ratio',
+    'Sortino Ratio',
+    'Calmar Ratio'
+]
+
+
+def _annualize(total: np.ndarray, period: int):
+    """
+    年化報酬 (總報酬低於 -100% 時沿用 stats() 的算法)
+    """
+    with np.errstate(invalid='ignore'):
+        return np.where(total > -1, (1+total)**(252/period) - 1, -((1-total)**(252/period) - 1))
+
+def _std(values: np.ndarray, mask: np.ndarray):
+    """
+    各欄 mask 內數值的樣本標準差 (不足兩筆時為 NaN)
+    """
+    count = mask.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(mask, values, 0).sum(axis=0) / count
+        var = np.where(mask, (values - mean)**2, 0).sum(axis=0) / (count - 1)
+    return np.where(count > 1, np.sqrt(var), np.nan)
+
+def batch_stats(payoff: pd.DataFrame, trades: pd.DataFrame, rf, benchmark: pd.Series = None, key: str = 'Strategy'):
+    """
+    一次計算多個策略的回測數據 (欄位同 QuantReport.stats())，回傳 pd.DataFrame (Index: 策略)
+    payoff: 每日報酬矩陣 (Index: 時間, Columns: 策略)
+    trades: 各策略的逐筆交易明細，key 欄位為所屬策略
+    rf: 無風險利率，可為各策略各自的陣列
+    benchmark: 基準指數每日報酬，預設為 0
+    """
+    values = np.array(payoff, dtype=float)
+    period, n = values.shape
+    index = payoff.index
+    equity = values.cumsum(axis=0) + 1
+    bench = np.zeros(period) if benchmark is None else np.asarray(benchmark, dtype=float)
+
+    ### 報酬、波動與回撤
+    totalRet = equity[-1] - 1
+    totalRetBM = (bench.cumsum() + 1)[-1] - 1
+    ret = _annualize(totalRet, period)
+    retBM = _annualize(np.array([totalRetBM]), period)[0]
+    vol = _std(values, np.ones_like(values, dtype=bool)) * np.sqrt(252)
+    volNeg = np.where(vol != 0, _std(values, values < 0) * np.sqrt(252), 0.0)
+    drawdown = equity / np.maximum.accumulate(equity, axis=0) - 1
+    tend = drawdown.argmin(axis=0)
+    tstart = np.where(np.arange(period)[:, None] <= tend, equity, -np.inf).argmax(axis=0)
+    mdd = np.abs(drawdown[tend, np.arange(n)])
+    duration = (index.values[tend] - index.values[tstart]).astype('timedelta64[D]').astype(int)
+    mean = values.mean(axis=0) * 252 - rf
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sharpe = np.where(vol != 0, mean / vol, 0.0)
+        sortino = np.where(volNeg != 0, mean / volNeg, 0.0)
+        calmar = np.where(mdd != 0, ret / mdd, 0.0)
+
+    ### 逐筆交易 (依策略分組)
+    group = pd.Index(payoff.columns).get_indexer(trades[key])
+    order = np.argsort(group, kind='mergesort')
+    order = order[group[order] >= 0]
+    group, value = group[order], np.asarray(trades.Return, dtype=float)[order]
+    count = np.bincount(group, minlength=n)
+    win = np.bincount(group, value > 0, minlength=n)
+    lose = np.bincount(group, value < 0, minlength=n)
+    gain = np.bincount(group, np.where(value > 0, value, 0), minlength=n)
+    loss = np.bincount(group, np.where(value < 0, value, 0), minlength=n)
+    start = np.searchsorted(group, np.arange(n))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        best = np.where(count > 0, np.fmax.reduceat(np.append(value, np.nan), np.minimum(start, len(value))), 0.0)
+        worst = np.where(count > 0, np.fmin.reduceat(np.append(value, np.nan), np.minimum(start, len(value))), 0.0)
+        valid = ~np.isnan(value)
+        avg = np.where(count > 0, np.bincount(group, np.where(valid, value, 0), minlength=n) / np.bincount(group, valid, minlength=n), 0.0)
+        winRate = np.where(count > 0, win / count, 0.0)
+        profitFactor = np.where(count > 0, gain / np.abs(loss), 0.0)
+        winLossRatio = np.where(count > 0, (gain / win) / np.abs(loss / lose), 0.0)
+
+    result = pd.DataFrame({
+        'Start Date': str(index[0])[:10],
+        'End Date': str(index[-1])[:10],
+        'Period [days]': period,
+        'Win Period [days]': (values > 0).sum(axis=0),
+        'Total Return [%]': np.round(totalRet*100, 2),
+        'Total Benchmark Return [%]': np.round(totalRetBM*100, 2),
+        'Return [%]': np.round(ret*100, 2),
+        'Benchmark Return [%]': np.round(retBM*100, 2),
+        'Volatility [%]': np.round(vol*100, 2),
+        'MDD [%]': np.round(mdd*100, 2),
+        'MDD Duration [days]': duration.astype(str),
+        'Total Trades': count,
+        'Win Rate [%]': np.round(winRate*100, 2),
+        'Best Trade [%]': np.round(best*100, 2),
+        'Worst Trade [%]': np.round(worst*100, 2),
+        'Average Trade [%]': np.round(avg*100, 2),
+        'Profit Factor': np.round(profitFactor, 2),
+        'Win Loss Ratio': np.round(winLossRatio, 2),
+        'Sharpe Ratio': np.round(sharpe, 2),
+        'Sortino Ratio': np.round(sortino, 2),
+        'Calmar Ratio': np.round(calmar, 2)
+    }, index=payoff.columns, columns=STATS)
+    return result
 
 
 class QuantReport:
     """
     plot(): 繪製淨值走勢圖
     analyze(): 策略報酬分析
+    resim(): 以不同交易成本重新產生報表
+    costs(): 多組交易成本情境的回測數據
     stats(): 詳細回測數據
     trades(): 逐筆交易資料
     best_trade(): 最佳交易標的
     worst_trade(): 最差交易標的
     """
     
-    def __init__(self, payoff_table: pd.DataFrame, equity_table: pd.DataFrame, trade_table: pd.DataFrame, hold_table: pd.Series, rf: float):
+    def __init__(self, payoff_table: pd.DataFrame, equity_table: pd.DataFrame, trade_table: pd.DataFrame, hold_table: pd.Series, rf: float, gross: dict = None):
         """
         每日報酬表、每日淨值表、逐筆交易明細、持有檔數明細、無風險利率
+        gross: 成本前的損益組成 (每日成本前報酬、進出場權重、逐筆價格比與權重、手續費、交易稅)，供 resim() 使用
         """
         self.payoff_table = payoff_table
         self.equity_table = equity_table
         self.trade_table = trade_table
         self.hold_table = hold_table
         self.rf = rf
+        self.gross = gross
+
+    def _costs(self, fee, tax):
+        """
+        各組交易成本下的每日報酬與逐筆交易報酬 (第二維為成本組合)
+        """
+        assert self.gross is not None, 'Re-simulation needs a report produced by sim()'
+        gross = self.gross
+        fee, tax = np.atleast_1d(np.asarray(fee, dtype=float)), np.atleast_1d(np.asarray(tax, dtype=float))
+        payoff = gross['payoff'][:, None] - fee * gross['entry'][:, None] - (fee + tax) * gross['exit'][:, None]
+        trade = (gross['ratio'][:, None] - 1 - 2 * fee - tax) * gross['weight'][:, None]
+        return payoff, trade
+
+    def resim(self, fee: float = None, tax: float = None, rf: float = None):
+        """
+        只改變手續費、交易稅或無風險利率時，以成本前損益重新產生報表 (不需重新執行 strategy()、sim())
+        未指定者沿用原設定
+        """
+        fee = self.gross['fee'] if fee is None and self.gross is not None else fee
+        tax = self.gross['tax'] if tax is None and self.gross is not None else tax
+        payoff, trade = self._costs(fee, tax)
+        payoff_table = self.payoff_table.copy()
+        payoff_table['Strategy'] = payoff[:, 0]
+        equity_table = payoff_table.cumsum() + 1
+        trade_table = self.trade_table.copy()
+        trade_table['Return'] = trade[:, 0]
+        return QuantReport(payoff_table, equity_table, trade_table, self.hold_table, self.rf if rf is None else rf, dict(self.gross, fee=fee, tax=tax))
+
+    def costs(self, fee: list = None, tax: list = None, rf: list = None):
+        """
+        一次計算多組交易成本情境 (手續費、交易稅、無風險利率的所有組合) 的回測數據
+        回傳 pd.DataFrame (Index: (Fee, Tax, Rf))，未指定者沿用原設定
+        """
+        assert self.gross is not None, 'Re-simulation needs a report produced by sim()'
+        grid = pd.MultiIndex.from_product([
+            [self.gross['fee']] if fee is None else list(fee),
+            [self.gross['tax']] if tax is None else list(tax),
+            [self.rf] if rf is None else list(rf),
+        ], names=['Fee', 'Tax', 'Rf'])
+        payoff, trade = self._costs(grid.get_level_values('Fee'), grid.get_level_values('Tax'))
+        payoff = pd.DataFrame(payoff, index=self.payoff_table.index)
+        trades = pd.DataFrame({'Return': trade.ravel(), 'Strategy': np.tile(np.arange(len(grid)), len(trade))})
+        result = batch_stats(payoff, trades, np.asarray(grid.get_level_values('Rf'), dtype=float), self.payoff_table.Benchmark)
+        result.index = grid
+        return result
 
     def display(self, name: str = 'Unnamed Strategy'):
         """
         繪製淨值走勢圖
         """
+        plt = pyplot()
         period = len(self.payoff_table.index)
         totalRet = self.equity_table.Strategy[-1] - 1
         ret = (1+totalRet)**(252/period) - 1 if totalRet > -1 else -((1-totalRet)**(252/period) - 1)
@@ -74,6 +234,9 @@ class QuantReport:
         """
         策略報酬分析
         """
+        import plotly.express as px
+        import plotly.graph_objects as go
+
         ### 策略累積報酬
         temp = self.payoff_table.cumsum()
         fig = go.Figure().set_subplots(rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.1)
@@ -120,6 +283,7 @@ class QuantReport:
         fig.show()
 
 
+    @traced('stats')
     def stats(self):
         """
         詳細回測數據
@@ -0,0 +1,33 @@
+''' 測試設定: 將本目錄的上層 (套件根目錄) 以 BBQuant 名稱匯入 '''
+
+import os
+import sys
+import importlib.util
+import numpy as np
+import pandas as pd
+import pytest
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if 'BBQuant' not in sys.modules:
+    spec = importlib.util.spec_from_file_location('BBQuant', os.path.join(ROOT, '__init__.py'), submodule_search_locations=[ROOT])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['BBQuant'] = module
+    spec.loader.exec_module(module)
+
+
+@pytest.fixture
+def make_close():
+    """
+    合成收盤價 (QuantDataFrame) 的產生函式: 對數常態隨機漫步，標的代號自 1101 起
+    late: 最後 30% 的標的晚上市 (前 10 日整列缺值)
+    """
+    def make(periods: int = 40, assets: int = 6, seed: int = 2, late: bool = False):
+        import BBQuant as bbq
+        dates = pd.bdate_range('2020-01-01', periods=periods)
+        values = np.random.default_rng(seed).lognormal(0, 0.02, (periods, assets)).cumprod(axis=0)
+        if late:
+            values[:10, int(assets * 0.7):] = np.nan
+        return bbq.transform(pd.DataFrame(values, index=dates, columns=[str(1101 + i) for i in range(assets)]))
+    return make
@@ -0,0 +1,217 @@
+''' 回測流程測試 '''
+
+import numpy as np
+import pandas as pd
+import pytest
+import BBQuant as bbq
+
+
+def test_no_entry_signal(make_close):
+    close = make_close()
+    bt = bbq.setting(close, benchmark=None)
+    position = bt.strategy(close > np.inf, close < 0)
+    assert (position.values == 0).all()
+
+
+def test_evaluation_error_propagates(make_close):
+    close = make_close()
+    bt = bbq.setting(close, benchmark=None)
+    broken = bbq.lazy(close).winsorize(0.9, 0.1)
+    with pytest.raises(AssertionError):
+        bt.strategy(broken > 0, close < 0)
+
+
+@pytest.mark.parametrize('n_jobs', [0, -2])
+def test_optimize_rejects_invalid_n_jobs(n_jobs, make_close):
+    close = make_close()
+    bt = bbq.setting(close, benchmark=None)
+    with pytest.raises(AssertionError, match='n_jobs'):
+        bt.optimize('nstocks', close > close.average(5), close < close.average(5), n_jobs=n_jobs)
+
+
+@pytest.mark.parametrize('ranked, benchmark', [(False, False), (True, True)])
+def test_process_pool_matches_serial(ranked, benchmark, monkeypatch, make_close):
+    close = make_close()
+    entry, exit = close > close.average(5), close < close.average(10)
+    rank = -close if ranked else None
+    benchmark = pd.Series(np.linspace(100, 110, len(close.data)), index=close.data.index) if benchmark else None
+    ### 不繪圖，直接回傳各候選策略的 (回測數據, 淨值走勢)
+    monkeypatch.setattr(bbq.QuantBacktest, '_compare', lambda self, title, label, results: results)
+
+    def run(n_jobs):
+        bt = bbq.setting(close, rank=rank, benchmark=benchmark)
+        return [bt.optimize(type, entry, exit, n_jobs=n_jobs) for type in ['stop', 'nstocks', 'freq']] + [bt.bestsim([entry, close > close.average(10)], [exit, None], n_jobs=n_jobs)]
+
+    for serial, pooled in zip(run(1), run(2)):
+        assert len(serial) == len(pooled)
+        for (stats, equity), (pooled_stats, pooled_equity) in zip(serial, pooled):
+            pd.testing.assert_series_equal(stats, pooled_stats, check_names=False)
+            pd.testing.assert_series_equal(equity, pooled_equity)
+
+
+def test_benchmark_loaded_once(make_close):
+    close = make_close()
+    calls = []
+
+    def provider():
+        calls.append(1)
+        return pd.Series(np.linspace(100, 110, len(close.data)), index=close.data.index)
+
+    bt = bbq.setting(close, benchmark=provider)
+    entry, exit = close > close.average(5), close < close.average(5)
+    bt.walkforward(entry, exit, grid={'nstocks': [2, 4]}, train=20, test=5)
+    bt.sweep(entry, exit, pairs=[(0.1, 0.05), (np.inf, np.inf)])
+    assert len(calls) == 1
+
+
+def _bars(days: pd.DatetimeIndex, spike: int):
+    """
+    單一標的、每日 3 根 K 棒的平盤價格，spike 日第二根 K 棒的最高價上漲 10%
+    """
+    rows = []
+    for day, date in enumerate(days):
+        for bar in range(3):
+            high = 110.0 if day == spike and bar == 1 else 100.0
+            rows.append({'datetime': date + pd.Timedelta(hours=9, minutes=bar+1), 'asset': '1101', 'open': 100.0, 'high': high, 'low': 100.0, 'close': 100.0})
+    return bbq.bars(pd.DataFrame(rows))
+
+
+@pytest.mark.parametrize('entry, fills', [('open', 1), ('close', 0)])
+def test_intraday_entry_day_bars(entry, fills):
+    dates = pd.bdate_range('2020-01-01', periods=8)
+    close = bbq.transform(pd.DataFrame(100.0, index=dates, columns=['1101']))
+    signal = bbq.transform(pd.DataFrame(np.arange(8)[:, None] >= 2, index=dates, columns=['1101']))
+    ### 第 2 日收盤訊號，第 3 日進場；進場日的 K 棒最高價超過停利價
+    bt = bbq.setting(close, take_profit=0.05, benchmark=None, engine='intraday', bars=_bars(dates, 3), entry=entry)
+    position = bt.strategy(signal, ~signal)
+    assert position.index[0] == dates[3]
+    assert len(position.attrs['fills']) == fills
+    assert position.loc[dates[4], '1101'] == (entry == 'close')
+
+
+@pytest.mark.parametrize('nstocks, take_profit, stop_loss', [(None, np.inf, np.inf), (3, np.inf, np.inf), (3, 0.03, 0.02)])
+def test_numpy_engine_matches_pandas(nstocks, take_profit, stop_loss, make_close):
+    close = make_close()
+    entry, exit = close > close.average(5), close < close.average(10)
+    positions = [bbq.setting(close, nstocks=nstocks, rank=-close, take_profit=take_profit, stop_loss=stop_loss, benchmark=None, engine=engine).strategy(entry, exit) for engine in ['numpy', 'pandas']]
+    pd.testing.assert_frame_equal(*positions)
+
+
+def test_trade_ledger_matches_position_runs(make_close):
+    close = make_close()
+    bt = bbq.setting(close, nstocks=3, rank=-close, benchmark=None)
+    position = bt.strategy(close > close.average(5), close < close.average(10))
+    trades = bt.sim(position).trade_table
+
+    ### 逐標的找出連續持有區間，出場日為最後持有日的隔日
+    values, price = position.values, close.data.reindex_like(position).values
+    expected = []
+    for col in range(values.shape[1]):
+        held = np.concatenate([[0], values[:, col], [0]])
+        for start, end in zip(np.flatnonzero(np.diff(held) == 1), np.flatnonzero(np.diff(held) == -1)):
+            if end < len(values):
+                expected.append((position.columns[col], position.index[start], position.index[end], price[start, col], price[end, col], values[end-1, col] / values[end-1].sum()))
+    expected = pd.DataFrame(expected, columns=['Asset', 'Entry Date', 'Exit Date', 'Entry Price', 'Exit Price', 'Weight']).sort_values(['Exit Date', 'Asset'], ignore_index=True)
+    assert len(expected) > 10
+    pd.testing.assert_frame_equal(trades[expected.columns], expected)
+
+
+def test_sweep_matches_individual_runs(make_close):
+    close = make_close()
+    entry, exit = close > close.average(5), close < close.average(10)
+    pairs = [(0.03, 0.02), (0.05, np.inf), (np.inf, np.inf)]
+    result = bbq.setting(close, nstocks=3, rank=-close, benchmark=None).sweep(entry, exit, pairs)
+    for take_profit, stop_loss in pairs:
+        bt = bbq.setting(close, nstocks=3, rank=-close, take_profit=take_profit, stop_loss=stop_loss, benchmark=None)
+        expected = bt.sim(bt.strategy(entry, exit)).stats()
+        pd.testing.assert_series_equal(result.loc[(take_profit, stop_loss)], expected, check_names=False)
+
+
+def test_holding_limit_sweep_matches_individual_runs(make_close):
+    close = make_close()
+    entry, exit = close > close.average(5), close < close.average(10)
+    reports = bbq.setting(close, rank=-close, take_profit=0.05, stop_loss=0.03, benchmark=None)._sweep(entry, exit, [(0.05, 0.03)], limits=[1, 3, None])
+    for nstocks in [1, 3, None]:
+        bt = bbq.setting(close, nstocks=nstocks, rank=-close, take_profit=0.05, stop_loss=0.03, benchmark=None)
+        position = bt.strategy(entry, exit)
+        report = reports[(nstocks, 0.05, 0.03)]
+        assert (report.hold_table.values == position.sum(axis=1).values).all()
+        pd.testing.assert_frame_equal(report.payoff_table, bt.sim(position).payoff_table)
+
+
+def _dense_payoff(position: pd.DataFrame, price: pd.DataFrame, fee: float, tax: float):
+    """
+    逐列計算的每日報酬 (稀疏持有區間計算的對照)
+    """
+    weight = np.array(position.div(position.sum(axis=1), axis=0).fillna(0).shift(1).fillna(0))
+    price = np.array(price.reindex_like(position))
+    entry = np.array((position != 0) & (position.shift(1) == 0))
+    exit = np.array((position == 0) & (position.shift(1) != 0))
+    entry_price = np.where(position.values[0] != 0, price[0], np.nan)
+    payoff = np.zeros(position.shape)
+    for i in range(1, len(position)):
+        entry_price[entry[i]] = price[i][entry[i]]
+        payoff[i] = (price[i] - price[i-1]) / entry_price
+        payoff[i][entry[i-1]] -= fee
+        payoff[i][exit[i]] -= fee + tax
+    return np.nansum(payoff * weight, axis=1)
+
+
+def test_sparse_sim_matches_dense_reference(make_close):
+    close = make_close()
+    bt = bbq.setting(close, nstocks=3, rank=-close, benchmark=None)
+    position = bt.strategy(close > close.average(5), close < close.average(10))
+    ### 0/1 部位與依部位數值加權的部位
+    weighted = position * np.random.default_rng(8).integers(1, 4, position.shape)
+    for frame in [position, weighted]:
+        np.testing.assert_allclose(bt.sim(frame).payoff_table.Strategy.values, _dense_payoff(frame, close.data, bt.fee, bt.tax), atol=1e-12)
+
+
+@pytest.mark.parametrize('anchored', [False, True])
+def test_walkforward_folds_stay_inside_windows(anchored, monkeypatch, make_close):
+    close = make_close()
+    entry, exit = close > close.average(5), close < close.average(10)
+    grid = {'nstocks': [1, 3, None]}
+    bt = bbq.setting(close, rank=-close, benchmark=None)
+
+    ### 記錄每個訓練/測試回測的區間與報表
+    reports = []
+    original = bbq.parallel.evaluate
+    def record(backtest, setting, *args, **kwargs):
+        reports.append((setting['period'], original(backtest, setting, args[0], args[1], report=True)[0]))
+        return original(backtest, setting, *args, **kwargs)
+    monkeypatch.setattr(bbq.parallel, 'evaluate', record)
+    table, report = bt.walkforward(entry, exit, grid=grid, train=15, test=5, anchored=anchored)
+
+    dates = close.data.index
+    assert list(table['Train Start']) == [dates[0] if anchored else dates[i] for i in range(0, 25, 5)]
+    assert list(table['Train End']) == [dates[i + 14] for i in range(0, 25, 5)]
+    assert list(table['Test Start']) == [dates[i + 15] for i in range(0, 25, 5)]
+    assert list(table['Test End']) == [dates[min(i + 19, 39)] for i in range(0, 25, 5)]
+    assert len(reports) == len(table) * (len(grid['nstocks']) + 1)
+    for (start, end), fold in reports:
+        assert fold.payoff_table.index[0] >= start and fold.payoff_table.index[-1] <= end
+        assert fold.trade_table['Exit Date'].between(start, end).all()
+        assert fold.hold_table.iloc[-1] == 0
+
+    ### 串接的交易明細與每日報酬一致 (各測試區間最後一日全部出場)
+    assert report.trade_table['Exit Date'].isin(report.payoff_table.index).all()
+    assert (report.hold_table.groupby(np.searchsorted(table['Test Start'].values, report.hold_table.index.values, 'right')).last() == 0).all()
+
+
+def test_walkforward_matches_manual_fold_optimization(make_close):
+    close = make_close()
+    entry, exit = close > close.average(5), close < close.average(10)
+    limits = [1, 3, None]
+    table, _ = bbq.setting(close, rank=-close, benchmark=None).walkforward(entry, exit, grid={'nstocks': limits}, train=15, test=5)
+
+    ### 各訓練區間以切片後的資料逐一回測，選出 Sharpe Ratio 最大的持有檔數上限
+    for _, fold in table.iterrows():
+        part = lambda frame: bbq.transform(frame.data.loc[fold['Train Start']:fold['Train End']])
+        scores = []
+        for nstocks in limits:
+            bt = bbq.setting(part(close), nstocks=nstocks, rank=part(-close), benchmark=None)
+            stats = bt.sim(bt.strategy(part(entry), part(exit))).stats()
+            scores.append(pd.to_numeric(stats['Sharpe Ratio'], errors='coerce'))
+        assert fold['nstocks'] == limits[int(np.nanargmax(scores))]
+        assert np.isclose(fold['Train Sharpe Ratio'], np.nanmax(scores))
@@ -0,0 +1,75 @@
+''' 指標快取測試 '''
+
+import os
+import pandas as pd
+import BBQuant as bbq
+
+
+def test_cache_hit(tmp_path, make_close):
+    bbq.use_cache(str(tmp_path))
+    try:
+        close = make_close()
+        first = close.average(5).data
+        files = os.listdir(tmp_path)
+        pd.testing.assert_frame_equal(close.average(5).data, first, check_freq=False)
+        assert os.listdir(tmp_path) == files
+    finally:
+        bbq.use_cache(None)
+
+
+def test_cache_miss_after_inplace_change_and_reassignment(tmp_path, make_close):
+    bbq.use_cache(str(tmp_path))
+    try:
+        close = make_close()
+        before = close.average(5).data
+        close.data.iloc[:, 0] *= 2
+        ### 原地修改後重新指定資料，使指紋重算
+        close.data = close.data
+        after = close.average(5).data
+        bbq.use_cache(None)
+        expected = close.average(5).data
+    finally:
+        bbq.use_cache(None)
+    pd.testing.assert_frame_equal(after, expected, check_freq=False)
+    assert not after.iloc[:, 0].equals(before.iloc[:, 0])
+
+
+def test_cache_miss_after_assignment(tmp_path, make_close):
+    bbq.use_cache(str(tmp_path))
+    try:
+        close = make_close()
+        close.average(5)
+        close.data = close.data * 3
+        after = close.average(5).data
+    finally:
+        bbq.use_cache(None)
+    pd.testing.assert_frame_equal(after, (close.data.rolling(5).mean()), check_freq=False)
+
+
+def test_cache_chain_hashes_source_once(tmp_path, monkeypatch, make_close):
+    calls = []
+    fingerprint = bbq._cache.fingerprint
+    monkeypatch.setattr(bbq._cache, 'fingerprint', lambda data: calls.append(1) or fingerprint(data))
+    bbq.use_cache(str(tmp_path))
+    try:
+        close = make_close()
+        for _ in range(2):
+            close.average(5).max(3).shift(1)
+            close.diff(2)
+    finally:
+        bbq.use_cache(None)
+    assert len(calls) == 1
+
+
+def test_cache_hit_matches_miss(tmp_path, make_close):
+    close = make_close()
+    close.data.index.name = None
+    methods = [('shift', 1), ('diff', 2), ('average', 5), ('largest', 2), ('zscore',)]
+    bbq.use_cache(str(tmp_path))
+    try:
+        misses = [getattr(close, name)(*args).data for name, *args in methods]
+        hits = [getattr(close, name)(*args).data for name, *args in methods]
+    finally:
+        bbq.use_cache(None)
+    for miss, hit in zip(misses, hits):
+        pd.testing.assert_frame_equal(hit, miss)
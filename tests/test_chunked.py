@@ -0,0 +1,54 @@
+''' 分塊運算測試 '''
+
+import os
+import gc
+import glob
+import tempfile
+import numpy as np
+import pandas as pd
+import pytest
+import BBQuant as bbq
+
+
+@pytest.mark.parametrize('gap', [False, True])
+def test_chunked_diff_matches_eager(tmp_path, make_close, gap):
+    close = make_close(periods=60, assets=20, late=True)
+    if gap:
+        ### 中間整列缺值的日期: diff() 刪除的日期不連續
+        close.data.iloc[30] = np.nan
+    lazy = bbq.lazy(close)
+    frames = [lazy.diff(2), lazy.diff(2) > 0, lazy.diff(2).largest(3), lazy.diff(2).zscore() + lazy]
+    bbq.chunked(*frames, columns=7, path=str(tmp_path))
+    expected = [close.diff(2), close.diff(2) > 0, close.diff(2).largest(3), close.diff(2).zscore() + close]
+    assert len(expected[0].data) < len(close.data)
+    for result, frame in zip(frames, expected):
+        pd.testing.assert_frame_equal(result.data, frame.data, check_freq=False)
+
+
+def test_chunked_same_path_keeps_results(tmp_path, make_close):
+    close = make_close(periods=60, assets=20, late=True)
+    first = bbq.lazy(close).average(3)
+    bbq.chunked(first, columns=7, path=str(tmp_path))
+    before = first.data.copy()
+    second = bbq.lazy(close) * 2
+    bbq.chunked(second, columns=7, path=str(tmp_path))
+    pd.testing.assert_frame_equal(first.data, before)
+    pd.testing.assert_frame_equal(second.data, close.data * 2, check_freq=False)
+
+
+def test_chunked_temporary_directory_removed(make_close):
+    before = set(glob.glob(os.path.join(tempfile.gettempdir(), 'bbquant-*')))
+    lazy = bbq.lazy(make_close(periods=60, assets=20, late=True)).average(3)
+    bbq.chunked(lazy, columns=7)
+    created = set(glob.glob(os.path.join(tempfile.gettempdir(), 'bbquant-*'))) - before
+    assert len(created) == 1 and os.listdir(next(iter(created)))
+    del lazy
+    gc.collect()
+    assert set(glob.glob(os.path.join(tempfile.gettempdir(), 'bbquant-*'))) - before == set()
+
+
+def test_chunked_cross_empty_index(tmp_path, make_close):
+    close = bbq.transform(make_close(periods=60, assets=20, late=True).data.iloc[:0])
+    lazy = bbq.lazy(close).largest(3)
+    bbq.chunked(lazy, columns=7, path=str(tmp_path))
+    assert lazy.data.shape == (0, 20) and lazy.data.dtypes.eq(bool).all()
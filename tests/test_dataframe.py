@@ -0,0 +1,114 @@
+''' QuantDataFrame 與共用索引測試 '''
+
+import numpy as np
+import pandas as pd
+import BBQuant as bbq
+from BBQuant.dataframe import universe, INDEXES
+
+
+def test_group_mapping_changed_in_place(make_close):
+    close = make_close()
+    group = {asset: 'A' for asset in close.data.columns}
+    close.neutralize(group=group)
+    group['1101'] = 'B'
+    result = close.neutralize(group=group).data
+    assert (result['1101'] == 0).all()
+    others = close.data.drop(columns='1101')
+    pd.testing.assert_frame_equal(result.drop(columns='1101'), others.sub(others.mean(axis=1), axis=0), check_freq=False)
+
+
+def test_index_cache_is_bounded(make_close):
+    close = make_close()
+    for start in range(INDEXES + 10):
+        universe.calendar(pd.bdate_range('2000-01-01', periods=5) + pd.Timedelta(days=start))
+        universe.groups(close.data.columns, {'1101': start})
+    assert len(universe.indexes) <= INDEXES
+
+
+def test_shared_calendar_and_assets_are_bounded(make_close):
+    first, second = universe.assign(make_close().data.copy()), universe.assign(make_close().data.copy())
+    assert first.index is second.index and first.columns is second.columns
+    for start in range(INDEXES + 10):
+        dates = pd.bdate_range('2000-01-01', periods=5) + pd.Timedelta(days=start)
+        universe.assign(pd.DataFrame(1.0, index=dates, columns=[f'{start}-{i}' for i in range(3)]))
+    assert len(universe.calendars) <= INDEXES and len(universe.universes) <= INDEXES
+
+
+def test_not_equal_treats_missing_as_false():
+    data = pd.DataFrame([[1.0, np.nan, 3.0], [np.nan, 2.0, 5.0]], index=pd.bdate_range('2020-01-01', periods=2))
+    other = pd.DataFrame([[1.0, 2.0, np.nan], [4.0, 2.0, 6.0]], index=data.index)
+    expected = pd.DataFrame([[False, False, False], [False, False, True]], index=data.index)
+    for left in [bbq.transform(data.copy()), bbq.lazy(data.copy())]:
+        pd.testing.assert_frame_equal((left != other).data, expected, check_freq=False)
+    pd.testing.assert_frame_equal((bbq.transform(data.copy()) != 1).data, pd.DataFrame([[False, False, True], [False, True, True]], index=data.index), check_freq=False)
+
+
+def test_float32_stays_float32(make_close):
+    close = bbq.transform(make_close().data.astype('float32'))
+    results = [+close, -close, close + 1, close - 1.5, close * 2, close / 2, close + close, close / close.data,
+               close.shift(1), close.total(3), close.max(3), close.min(3), close.diff(1), close.average(3),
+               close.zscore(), close.percentile(), close.winsorize(), close.neutralize(), (bbq.lazy(close) + 1).average(3) * 2]
+    assert all(result.data.dtypes.eq(np.float32).all() for result in results)
+    assert (close.average(3) > close).data.dtypes.eq(bool).all()
+    assert (close + make_close()).data.dtypes.eq(np.float64).all()
+
+
+def test_lazy_leaf_keeps_caller_index():
+    data = pd.DataFrame(np.arange(12.0).reshape(4, 3), index=['2020-01-02', '2020-01-03', '2020-01-06', '2020-01-07'])
+    index = data.index
+    result = (bbq.lazy(data) + 1).data
+    assert data.index is index and isinstance(result.index, pd.DatetimeIndex)
+
+
+def test_largest_smallest_match_pandas_rank():
+    values = np.random.default_rng(4).integers(0, 5, (50, 12)).astype(float)
+    values[np.random.default_rng(5).random(values.shape) < 0.2] = np.nan
+    data = pd.DataFrame(values, index=pd.bdate_range('2020-01-01', periods=50), columns=[str(1101 + i) for i in range(12)])
+    frame = bbq.transform(data)
+    for n in [1, 3, 12]:
+        pd.testing.assert_frame_equal(frame.largest(n).data, data.rank(axis=1, method='first', ascending=False) <= n)
+        pd.testing.assert_frame_equal(frame.smallest(n).data, data.rank(axis=1, method='first') <= n)
+
+
+def test_calendar_matches_resample():
+    dates = pd.bdate_range('2020-01-01', periods=300)
+    dates = dates.delete(list(range(40, 46)) + [100, 150, 151])
+    calendar = universe.calendar(dates)
+    position = pd.Series(np.arange(len(dates)), index=dates)
+    for freq in ['W', 'M', 'Q', 'W-FRI']:
+        last = position.resample(freq).last()
+        pd.testing.assert_index_equal(calendar.labels(freq), last.index, check_names=False)
+        np.testing.assert_array_equal(calendar.last(freq), last.ffill().values)
+        bucket = pd.Series(np.arange(len(last)), index=last.index).reindex(dates, method='ffill').fillna(-1)
+        np.testing.assert_array_equal(calendar.bucket(freq), bucket.values)
+
+
+def _wide(series: pd.Series, long: pd.DataFrame):
+    """
+    將長格式的逐列結果轉回 (日期, 標的) 表
+    """
+    return series.reindex(long.index).set_axis(pd.MultiIndex.from_frame(long[['datetime', 'asset']])).unstack().rename_axis(index=None, columns=None)
+
+
+def test_grouped_operators_match_pandas_groupby():
+    values = np.random.default_rng(9).normal(size=(40, 10))
+    values[np.random.default_rng(10).random(values.shape) < 0.1] = np.nan
+    ### 單一群組的 inf 不影響同一日的其他群組
+    values[5, 0], values[12, 2], values[12, 1] = np.inf, -np.inf, np.inf
+    data = pd.DataFrame(values, index=pd.bdate_range('2020-01-01', periods=40), columns=[str(1101 + i) for i in range(10)])
+    group = {asset: 'AB'[i % 2] for i, asset in enumerate(data.columns[:-1])}
+    frame = bbq.transform(data)
+
+    ### 以長格式逐 (日期, 群組) 計算，未對應到群組的標的為缺值
+    long = data.stack(dropna=False).rename('value').reset_index()
+    long.columns = ['datetime', 'asset', 'value']
+    grouped = long.assign(group=long.asset.map(group)).groupby(['datetime', 'group']).value
+    expected = lambda series: _wide(series, long)
+
+    mean, std = grouped.transform('mean'), grouped.transform('std')
+    low, high = grouped.transform(lambda s: s.quantile(0.1)), grouped.transform(lambda s: s.quantile(0.9))
+    pd.testing.assert_frame_equal(frame.neutralize(group=group).data, expected(long.value - mean), check_freq=False)
+    pd.testing.assert_frame_equal(frame.zscore(group=group).data, expected((long.value - mean) / std), check_freq=False)
+    pd.testing.assert_frame_equal(frame.percentile(group=group).data, expected(grouped.rank(pct=True)), check_freq=False)
+    pd.testing.assert_frame_equal(frame.winsorize(0.1, 0.9, group=group).data, expected(long.value.clip(low, high).where(low.notna())), check_freq=False)
+    pd.testing.assert_frame_equal(frame.largest(2, group=group).data, expected(grouped.rank(method='first', ascending=False) <= 2).fillna(False).astype(bool), check_freq=False)
@@ -0,0 +1,44 @@
+''' 輕量匯入測試: 計算流程不載入繪圖套件 '''
+
+import os
+import sys
+import json
+import subprocess
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+### 計算流程不應載入的模組
+FORBIDDEN = ['matplotlib', 'plotly', 'IPython']
+
+SCRIPT = '''
+import os, sys, json, importlib.util
+root, forbidden = sys.argv[1], json.loads(sys.argv[2])
+
+### 匯入攔截: 記錄並拒絕載入繪圖套件 (套件未安裝時也能發現提前匯入)
+attempts = []
+class Block:
+    def find_spec(self, name, path=None, target=None):
+        if name.split('.')[0] in forbidden:
+            attempts.append(name)
+            raise ImportError(name)
+sys.meta_path.insert(0, Block())
+
+spec = importlib.util.spec_from_file_location('BBQuant', os.path.join(root, '__init__.py'), submodule_search_locations=[root])
+sys.modules['BBQuant'] = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(sys.modules['BBQuant'])
+import BBQuant as bbq
+import numpy as np, pandas as pd
+dates = pd.bdate_range('2020-01-01', periods=120)
+close = bbq.transform(pd.DataFrame(np.random.default_rng(0).lognormal(0, 0.02, (120, 20)).cumprod(axis=0), index=dates))
+bt = bbq.setting(close, nstocks=5, benchmark=None)
+report = bt.sim(bt.strategy(close > close.average(5), close < close.average(20)))
+report.stats()
+print(json.dumps(attempts))
+'''
+
+
+def test_compute_path_does_not_import_plotting():
+    output = subprocess.run([sys.executable, '-c', SCRIPT, ROOT, json.dumps(FORBIDDEN)], check=True, capture_output=True, text=True).stdout
+    assert json.loads(output.strip().splitlines()[-1]) == []
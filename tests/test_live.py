@@ -0,0 +1,32 @@
+''' 逐日續算回測測試 '''
+
+import numpy as np
+import pandas as pd
+import pytest
+import BBQuant as bbq
+
+
+def _frames():
+    dates = pd.bdate_range('2020-01-01', periods=80)
+    values = np.random.default_rng(6).lognormal(0, 0.02, (80, 8)).cumprod(axis=0)
+    close = pd.DataFrame(values, index=dates, columns=[str(1101 + i) for i in range(8)])
+    return close, close > close.rolling(5).mean(), close < close.rolling(10).mean()
+
+
+def _cut(data: pd.DataFrame, date):
+    return bbq.transform(data.loc[:date])
+
+
+@pytest.mark.parametrize('nstocks, take_profit, stop_loss', [(None, np.inf, np.inf), (3, 0.03, 0.02)])
+def test_update_matches_full_backtest(nstocks, take_profit, stop_loss):
+    close, entry, exit = _frames()
+    dates = close.index
+    setting = lambda date: bbq.setting(_cut(close, date), nstocks=nstocks, rank=_cut(-close, date), take_profit=take_profit, stop_loss=stop_loss, benchmark=None)
+    live = setting(dates[40]).live(_cut(entry, dates[40]), _cut(exit, dates[40]))
+    for date in [dates[41], dates[42], dates[50], dates[-1]]:
+        live.update(_cut(entry, date), _cut(exit, date), trade_price=_cut(close, date), rank=_cut(-close, date))
+        bt = setting(date)
+        expected, report = bt.sim(bt.strategy(_cut(entry, date), _cut(exit, date))), live.report()
+        pd.testing.assert_frame_equal(report.payoff_table, expected.payoff_table, check_freq=False)
+        pd.testing.assert_frame_equal(report.trade_table, expected.trade_table, check_dtype=False)
+        pd.testing.assert_series_equal(report.hold_table, expected.hold_table, check_freq=False, check_names=False, check_dtype=False)
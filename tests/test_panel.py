@@ -0,0 +1,59 @@
+''' 多欄位資料集測試 '''
+
+import numpy as np
+import pandas as pd
+import pytest
+import BBQuant as bbq
+
+
+FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+def _minute():
+    times = pd.date_range('2020-01-02 09:01', periods=5, freq='min').append(pd.date_range('2020-01-03 09:01', periods=5, freq='min'))
+    rng = np.random.default_rng(11)
+    rows = [(time, asset, *rng.normal(100, 1, 4), float(rng.integers(1, 9))) for time in times for asset in ['1101', '1102', '1103']]
+    data = pd.DataFrame(rows, columns=['datetime', 'asset', 'open', 'high', 'low', 'close', 'volume'])
+    data.loc[rng.random(len(data)) < 0.1, 'close'] = np.nan
+    return data
+
+
+def _panels(data: pd.DataFrame, path):
+    """
+    同一份資料以記憶體、串流 (小批次) 與 get() 讀入
+    """
+    pytest.importorskip('pyarrow')
+    data.reset_index(drop=True).to_feather(path)
+    panels = [bbq.load(data), bbq.load(str(path), batch_size=4)]
+    return [{field: panel[field].data for field in FIELDS} for panel in panels] + [{field: bbq.get(data.copy(), field).data for field in FIELDS}]
+
+
+def _assert_same(panels: list):
+    for panel in panels[1:]:
+        for field in FIELDS:
+            np.testing.assert_array_equal(panel[field].values, panels[0][field].values)
+
+
+def test_load_does_not_depend_on_row_order(tmp_path):
+    data = _minute()
+    shuffled = data.sample(frac=1, random_state=0)
+    _assert_same(_panels(data, tmp_path / 'ordered.ftr') + _panels(shuffled, tmp_path / 'shuffled.ftr'))
+
+
+@pytest.mark.parametrize('daily', [False, True])
+def test_duplicate_rows_are_aggregated_consistently(tmp_path, daily):
+    data = _minute()
+    if daily:
+        data['datetime'] = data.datetime.dt.normalize()
+    ### 相同時間、標的的重複列 (位於較後面，且日期早於前一筆)
+    duplicate = data.iloc[[0, 0]].assign(open=[1.0, 2.0], close=[3.0, np.nan], volume=[1.0, 1.0])
+    data = pd.concat([data, duplicate], ignore_index=True)
+    panels = _panels(data, tmp_path / 'duplicate.ftr')
+    _assert_same(panels)
+
+    ### 依時間先後 (同時間者依資料順序): Open 取第一筆、Close 取最後一筆非缺值、Volume 加總
+    date, asset = data.datetime[0].normalize(), data.asset[0]
+    first = data[(data.datetime.dt.normalize() == date) & (data.asset == asset)].sort_values('datetime', kind='mergesort')
+    assert panels[0]['Open'].loc[date, asset] == first.open.iloc[0]
+    assert panels[0]['Close'].loc[date, asset] == first.close.dropna().iloc[-1]
+    assert panels[0]['Volume'].loc[date, asset] == first.volume.sum()
@@ -0,0 +1,49 @@
+''' 效能剖析測試 '''
+
+import json
+import numpy as np
+import BBQuant as bbq
+from BBQuant.profiler import span
+
+
+def test_nested_span_keeps_parent_peak():
+    with bbq.profile(memory=True) as profiler:
+        with span('outer'):
+            temp = np.ones(1 << 20)
+            del temp
+            with span('inner'):
+                np.ones(10)
+    record = {item['name']: item for item in profiler.spans}
+    assert record['outer']['peak_bytes'] >= 8 << 20
+    assert record['inner']['peak_bytes'] < 1 << 20
+
+
+def test_pipeline_spans_and_traces(tmp_path, make_close):
+    close = make_close()
+    bt = bbq.setting(close, nstocks=3, rank=-close, benchmark=None)
+    entry, exit = close > close.average(5), close < close.average(10)
+    with bbq.profile(memory=True) as profiler:
+        report = bt.sim(bt.strategy(entry, exit))
+    record = {item['name']: item for item in profiler.spans}
+
+    ### strategy() 與 sim() 的各階段都有區段，部位相關的區段記錄形狀
+    stages = ['signal.evaluate', 'signal.calendar', 'signal.reindex', 'signal.ranking', 'signal.price', 'strategy.hold', 'strategy',
+              'sim.align', 'sim.benchmark', 'sim.intervals', 'sim.payoff', 'sim.ledger', 'sim.tables', 'sim']
+    assert all(name in record for name in stages)
+    shape = [len(report.hold_table), len(close.data.columns)]
+    for name in ['signal.reindex', 'strategy.hold', 'sim.align', 'sim.intervals']:
+        assert record[name]['shapes']['position'] == shape
+    assert record['strategy']['shapes']['output'] == shape
+    assert record['strategy']['depth'] == 0 and record['strategy.hold']['depth'] == 1
+
+    ### Chrome trace: 每個區段一個 complete event
+    events = json.loads(profiler.to_chrome(str(tmp_path / 'trace.json')))['traceEvents']
+    assert json.loads((tmp_path / 'trace.json').read_text())['traceEvents'] == events
+    assert len(events) == len(profiler.spans)
+    assert all(event['ph'] == 'X' and event['dur'] >= 0 and event['ts'] >= 0 and 'peak_bytes' in event['args'] for event in events)
+    spans = json.loads(profiler.to_json())
+    assert [item['start'] for item in spans] == sorted(item['start'] for item in profiler.spans)
+
+    summary = profiler.summary()
+    assert set(stages) <= set(summary.index)
+    assert summary.loc['strategy', 'Calls'] == 1 and (summary['Total [s]'].diff().dropna() <= 0).all()
@@ -0,0 +1,34 @@
+''' 回測報表測試 '''
+
+import pandas as pd
+import BBQuant as bbq
+
+
+def _reports(close: bbq.QuantDataFrame, **kwargs):
+    entry, exit = close > close.average(5), close < close.average(10)
+    reports = []
+    for nstocks in [1, 3, None]:
+        bt = bbq.setting(close, nstocks=nstocks, rank=-close, benchmark=close.data.mean(axis=1), **kwargs)
+        reports.append(bt.sim(bt.strategy(entry, exit)))
+    return reports
+
+
+def test_batch_stats_matches_stats(make_close):
+    reports = _reports(make_close(periods=60, assets=8))
+    payoff = pd.DataFrame({i: report.payoff_table.Strategy for i, report in enumerate(reports)})
+    trades = pd.concat([report.trade_table[['Return']].assign(Strategy=i) for i, report in enumerate(reports)])
+    result = bbq.batch_stats(payoff, trades, 0.015, reports[0].payoff_table.Benchmark)
+    for i, report in enumerate(reports):
+        pd.testing.assert_series_equal(result.loc[i], report.stats(), check_names=False)
+
+
+def test_resim_matches_full_sim(make_close):
+    close = make_close(periods=60, assets=8)
+    report = _reports(close)[1]
+    for fee, tax, rf in [(0.0, 0.0, 0.0), (0.002, 0.001, 0.03)]:
+        expected = _reports(close, fee=fee, tax=tax, rf=rf)[1]
+        result = report.resim(fee, tax, rf)
+        pd.testing.assert_frame_equal(result.payoff_table, expected.payoff_table)
+        pd.testing.assert_frame_equal(result.trade_table, expected.trade_table)
+        pd.testing.assert_series_equal(result.stats(), expected.stats())
+        pd.testing.assert_series_equal(report.costs([fee], [tax], [rf]).iloc[0], expected.stats(), check_names=False)